@@ -1,21 +1,21 @@
 import datetime
 from functools import partial
+from io import StringIO
 
-import json
 import numpy as np
 import pyqtgraph as pg
 import pytz
-import requests
-import yfinance as yahoo
 from PyQt5 import uic
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from pandas import DataFrame, Series, date_range, to_datetime, Timestamp, Timedelta, isnull
-from pandas import concat, read_json, offsets, read_csv
+from pandas import concat, read_json, read_csv
 from plot import PlotWidget, PlotCurveItem
 from scipy.optimize import curve_fit
 
+from market.transport import client
 from thread import Worker
+from util import get_cpi as cpi_series
 
 UNIX_EPOCH_naive = datetime.datetime(1970, 1, 1, 0, 0)  # offset-naive datetime
 UNIX_EPOCH_offset_aware = datetime.datetime(1970, 1, 1, 0, 0, tzinfo=pytz.utc)  # offset-aware datetime
@@ -45,9 +45,6 @@ def linear_fit(x, a, b):
 	return a * x + b
 
 
-cpi_ibge_url = 'https://servicodados.ibge.gov.br/api/v3/agregados/1737/periodos/{0}/variaveis/2266?localidades=N1[all]'
-
-
 def get_cpi_ibge(start_date=None, end_date=None):
 	"""
 	Retrieves the CPI (Consumer Price Index) from the IBGE API.
@@ -82,13 +79,8 @@ def get_cpi_ibge(start_date=None, end_date=None):
 		raise ValueError("Trying to fetch data from the future...")
 
 	query_period = date_range(start_date, end_date, freq='MS')
-	periods = '|'.join(map(lambda x: x.strftime('%Y%m'), query_period))
-	api_page = requests.get(cpi_ibge_url.format(periods))
-	# return url
-	api_data = json.loads(api_page.text)
-	cpi = DataFrame.from_dict(api_data[0]['resultados'][0]['series'][0]['serie'], orient='index', columns=['CPI-BR'], dtype=float)
-	cpi.index = to_datetime(cpi.index, format='%Y%m')
-	cpi = cpi['CPI-BR']
+	months, values = cpi_series('BR').months(query_period[0], query_period[-1])
+	cpi = Series(values, index=to_datetime(months), name='CPI-BR')
 
 	if query_period[-1] > cpi.index[-1]:
 		print("Warning: Asking for inflation data which is unavailable, extrapolating from last 12 months.")
@@ -133,9 +125,10 @@ def get_inflation_rate_ibge(reference_date, current_date='latest', date_format='
 		reference_date = strptime(reference_date, date_format)
 	else:
 		reference_date = reference_date.round('d')
+	cpi = cpi_series('BR')
 	if isinstance(current_date, str):
 		if current_date == 'latest':
-			latest_data = get_cpi_ibge().index[-1]
+			current_date = strptime(cpi.last, '%Y%m')
 		else:
 			current_date = strptime(current_date, date_format)
 	else:
@@ -150,19 +143,10 @@ def get_inflation_rate_ibge(reference_date, current_date='latest', date_format='
 	if rate_by not in rate_by_options:
 		raise ValueError(f"'{rate_by}' rates not supported. Try one of {rate_by_options}")
 
-	api_page = requests.get(cpi_ibge_url.format(f"{reference_date.strftime('%Y%m')}|{current_date.strftime('%Y%m')}"))
-	api_data = json.loads(api_page.text)
-	cpi = api_data[0]['resultados'][0]['series'][0]['serie']
-	cpi = DataFrame.from_dict(cpi, orient='index', columns=['cpi'], dtype=float)
-	cpi.index = to_datetime(cpi.index, format='%Y%m')
-
-	if current_date == cpi.index[-1]:
-		pass
-	else:
-		latest_data = get_cpi_ibge().index[-1]
-		raise ValueError(f"IBGE API did not relay data until requested date. Lastest CPI info avaible is from {latest_data.strftime('%Y-%m')}.")
+	if cpi.month(current_date) is None or cpi.month(reference_date) is None:
+		raise ValueError(f"IBGE API did not relay data until requested date. Lastest CPI info avaible is from {cpi.last[:4]}-{cpi.last[4:]}.")
 
-	cpi_inflation = cpi.iloc[-1] / cpi.iloc[0]
+	cpi_inflation = cpi.month(current_date) / cpi.month(reference_date)
 	dt = (current_date - reference_date).days
 
 	if rate_by == 'day':
@@ -177,7 +161,7 @@ def get_inflation_rate_ibge(reference_date, current_date='latest', date_format='
 		dt = 1
 
 	cpi_inflation = (cpi_inflation) ** (1 / dt)
-	inflation_rate = cpi_inflation['cpi'] - 1
+	inflation_rate = cpi_inflation - 1
 	return inflation_rate
 
 
@@ -218,21 +202,9 @@ def get_cpi_bls(start_date=None, end_date=None):
 
 	if start_date > end_date:
 		raise ValueError("End date must be later than start date")
-	elif round((end_date - start_date).days / 365, 1) > 10:
-		print(round((end_date - start_date).days / 365, 1))
-		raise ValueError("BLS API allows queries spanning at most 10 years")
-
-	headers = {'Content-type': 'application/json'}
-	data = json.dumps({"seriesid": ['CUUR0000SA0'], "startyear": str(start_date.year), "endyear": str(end_date.year)})
-	api_page = requests.post('https://api.bls.gov/publicAPI/v1/timeseries/data/', data=data, headers=headers)
-	api_data = json.loads(api_page.text)
-	if api_data['status'] != 'REQUEST_SUCCEEDED':
-		raise Exception(f"Request failed {api_data['message']}")
-	api_data = DataFrame(api_data['Results']['series'][0]['data'])
-	api_data.index = to_datetime((api_data['year'] + api_data['period']).map(lambda x: x.replace('M', '')), format='%Y%m')
-	api_data = api_data.drop(['year', 'period', 'periodName', 'footnotes'], axis=1)
-	cpi = api_data.rename(columns={'value': 'CPI-US'}).sort_index()
-	return cpi['CPI-US']
+
+	months, values = cpi_series('US').months(start_date, end_date)
+	return Series(values, index=to_datetime(months), name='CPI-US')
 
 
 def get_cpi(location, start_date=None, end_date=None):
@@ -245,10 +217,21 @@ def get_cpi(location, start_date=None, end_date=None):
 
 
 def col_data(ticker, start_date, end_date):
-	Ticker = yahoo.Ticker(ticker)
-	df = Ticker.history(interval='1mo', start=start_date, end=end_date, actions=False, back_adjust=True).dropna()
-	df.index = df.index + offsets.MonthBegin(0)
-	return df['Close']
+	"""
+	Monthly dividend and split adjusted closes from the Yahoo Finance chart API, indexed by month start
+
+	Symbols without adjusted closes (indexes, currencies) use the plain close
+	"""
+	url = 'https://query2.finance.yahoo.com/v8/finance/chart/{}?period1={}&period2={}&interval=1mo&events=div%2Csplit'
+	result = client.get_json(url.format(ticker, int(start_date.timestamp()), int(end_date.timestamp())))['chart']['result'][0]
+	indicators = result['indicators']
+	if indicators.get('adjclose'):
+		close = indicators['adjclose'][0]['adjclose']
+	else:
+		close = indicators['quote'][0]['close']
+	df = Series(close, index=to_datetime(result['timestamp'], unit='s'), dtype=float).dropna()
+	df.index = df.index.to_period('M').to_timestamp()
+	return df
 
 
 def int2dt(ts, ts_mult=TS_MULT_us):
@@ -308,7 +291,7 @@ class Analysis(QWidget):
 	def process(self, start_date, end_date, usstocks, brstocks):
 		cpi = get_cpi('BR', start_date, end_date)
 		inputs = (cpi / cpi.iloc[0]).to_frame('BRL')
-		usdbrl = read_json('https://api.bcb.gov.br/dados/serie/bcdata.sgs.3698/dados?formato=json')
+		usdbrl = read_json(StringIO(client.get_text('https://api.bcb.gov.br/dados/serie/bcdata.sgs.3698/dados?formato=json')))
 		usdbrl.data = to_datetime(usdbrl.data, format='%d/%m/%Y')
 		usdbrl = usdbrl.set_index('data')
 		inputs['USDBRL'] = usdbrl['valor'][inputs.index]
@@ -317,7 +300,7 @@ class Analysis(QWidget):
 
 		cpi = get_cpi('BR', strptime('1994-07-01'), end_date)
 		cum_inflation = (cpi / cpi.iloc[0]).to_frame('BR')
-		df_inflation_us = read_csv('https://www.statbureau.org/en/united-states/inflation-tables/inflation.monthly.csv').set_index('Year').drop(columns=' Total')
+		df_inflation_us = read_csv(StringIO(client.get_text('https://www.statbureau.org/en/united-states/inflation-tables/inflation.monthly.csv'))).set_index('Year').drop(columns=' Total')
 		df_inflation_us.index = df_inflation_us.index.astype(str)
 		df_inflation_us = df_inflation_us.stack()
 		df_inflation_us.index = map(strptime, df_inflation_us.index.map('/'.join), ['%Y/ %B'] * len(df_inflation_us))
@@ -67,8 +67,22 @@ class BottomPanel(QWidget):
 		it.raise_window()
 
 
+	def clear(self):
+		"""Remove the data shown by update_data, so the panel can show a reloaded portfolio"""
+		self.stock_tree.clear()
+		while self.summary.rowCount():
+			self.summary.removeRow(0)
+		self.summary_labels = {}
+		for value, items in self.ui_items.items():
+			for item in items.values():
+				self.ui_grids[value].removeWidget(item)
+				item.deleteLater()
+		self.ui_items = {}
+		self.piechart.removeAllSeries()
+
 	def update_data(self,position,portfolio_data):
 
+		self.clear()
 		for type,items in position.items():
 			for ticker, stock in items.items():
 				item = TreeWidgetItem(self.stock_tree, stock)
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from PyQt5.QtCore import QAbstractProxyModel, QAbstractTableModel, QModelIndex, Qt
+
+
+class TransactionModel(QAbstractTableModel):
+    """
+    Table model over the columns of a transactions DataFrame
+
+    Nothing is copied or formatted up front, the view asks only for the cells it shows.
+    """
+
+    def __init__(self, parent=None):
+        super(TransactionModel, self).__init__(parent)
+        self.header = []
+        self.columns = []
+        self.rows = 0
+
+    def set_transactions(self, transactions):
+        self.beginResetModel()
+        self.header = [str(i) for i in transactions.columns]
+        self.columns = [transactions[i].values for i in transactions.columns]
+        self.rows = len(transactions)
+        self.endResetModel()
+
+    def column(self, name):
+        return self.columns[self.header.index(name)]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.header)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.columns[index.column()][index.row()]
+        if role == Qt.DisplayRole:
+            return self.format(value)
+        if role == Qt.TextAlignmentRole and isinstance(value, (int, float, np.number)):
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    @staticmethod
+    def format(value):
+        if isinstance(value, np.datetime64):
+            return pd.Timestamp(value).strftime('%d/%m/%Y') if not np.isnat(value) else ''
+        if isinstance(value, (float, np.floating)):
+            if np.isnan(value):
+                return ''
+            return '{:g}'.format(value) if float(value).is_integer() else '{:.2f}'.format(value)
+        return str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.header[section] if section < len(self.header) else None
+        return str(section + 1)
+
+
+class PermutationProxyModel(QAbstractProxyModel):
+    """
+    Sorts and filters a TransactionModel through an array of source rows
+
+    Sorting is one stable NumPy argsort of the column and filtering one vectorized match, instead of the per row Python
+    comparisons of QSortFilterProxyModel.
+    """
+
+    def __init__(self, parent=None):
+        super(PermutationProxyModel, self).__init__(parent)
+        self.rows = np.zeros(0, dtype=np.int64)  # Proxy row -> source row
+        self.positions = np.zeros(0, dtype=np.int64)  # Source row -> proxy row, -1 if filtered out
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        self.filter_text = ''
+        self.filter_column = 'Symbol'
+
+    def setSourceModel(self, model):
+        if self.sourceModel() is not None:
+            self.sourceModel().modelReset.disconnect(self.invalidate)
+        super(PermutationProxyModel, self).setSourceModel(model)
+        model.modelReset.connect(self.invalidate)
+        self.invalidate()
+
+    def invalidate(self):
+        """Recompute the rows from the source, the current filter and the current sort"""
+        self.beginResetModel()
+        model = self.sourceModel()
+        rows = np.arange(model.rows, dtype=np.int64)
+
+        if self.filter_text and self.filter_column in model.header:
+            values = model.column(self.filter_column)
+            if isinstance(values, pd.Categorical):
+                # Match the few categories once and select rows by code
+                matches = pd.Series(values.categories).astype(str).str.contains(self.filter_text, case=False,
+                                                                               regex=False).values
+                rows = rows[np.append(matches, False)[values.codes]]  # Code -1 (missing) picks the False
+            else:
+                rows = rows[pd.Series(values).astype(str).str.contains(self.filter_text, case=False,
+                                                                       regex=False).values]
+
+        if 0 <= self.sort_column < len(model.columns):
+            values = model.columns[self.sort_column]
+            if isinstance(values, pd.Categorical):
+                # Rank of every category in sorted order, missing values (code -1) rank last
+                ranks = np.append(np.argsort(values.categories.argsort()), len(values.categories))
+                key = ranks[values.codes[rows]]
+            else:
+                key = np.asarray(values[rows])
+            if key.dtype == object:
+                key = key.astype(str)
+            order = np.argsort(key, kind='stable')
+            if self.sort_order == Qt.DescendingOrder:
+                order = order[::-1]
+            rows = rows[order]
+
+        self.rows = rows
+        self.positions = np.full(model.rows, -1, dtype=np.int64)
+        self.positions[rows] = np.arange(len(rows))
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self.invalidate()
+
+    def set_filter(self, text, column='Symbol'):
+        self.filter_text = text
+        self.filter_column = column
+        self.invalidate()
+
+    def mapToSource(self, index):
+        if not index.isValid() or index.row() >= len(self.rows):
+            return QModelIndex()
+        return self.sourceModel().index(int(self.rows[index.row()]), index.column())
+
+    def mapFromSource(self, index):
+        if not index.isValid() or self.positions[index.row()] < 0:
+            return QModelIndex()
+        return self.index(int(self.positions[index.row()]), index.column())
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not 0 <= row < len(self.rows) or not 0 <= column < self.columnCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() or self.sourceModel() is None else self.sourceModel().columnCount()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            return self.sourceModel().headerData(section, orientation, role)
+        if role == Qt.DisplayRole and section < len(self.rows):
+            return str(int(self.rows[section]) + 1)
+        return None
@@ -4,13 +4,11 @@ from PyQt5.QtWidgets import *
 from import_res import resource_path
 
 QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
-from .transaction_item import TransactionItem
-import pandas as pd
+from .transaction_model import PermutationProxyModel, TransactionModel
+from financial.ledger import TransactionSources
 
 
 class Transactions(QWidget):
-    header = ['Entrada/Saída', 'Date', 'Movimentação', 'Produto', 'Instituição', 'Quantity', 'Preço unitário',
-              'Valor da Operação', 'Ignore']
 
     def __init__(self, mainwindow):
 
@@ -19,7 +17,8 @@ class Transactions(QWidget):
         self.mainwindow = mainwindow
         self.load_ui()
         self.transactions = None
-        self.transaction_items = []
+        self.sources = None  # Source specs from the config, see TransactionSources
+        self.source = None
         self.filename = None
 
     def load_ui(self):
@@ -28,38 +27,33 @@ class Transactions(QWidget):
         self.setWindowFlags(self.windowFlags() & QtCore.Qt.CustomizeWindowHint)
         self.setWindowFlags(self.windowFlags() & ~QtCore.Qt.WindowMinMaxButtonsHint)
 
-        self.tree.setHeaderLabels(self.header)
-
-    def load_transactions(self, message):
-
-        self.filename = QtWidgets.QFileDialog.getOpenFileName(self, 'Select transaction files', '.', '(*.csv *.txt')[0]
-        self.mainwindow.update_thread()
+        self.model = TransactionModel(self)
+        self.proxy = PermutationProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.table.setModel(self.proxy)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(-1, Qt.AscendingOrder)
+        # Uniform row heights let the view skip measuring rows it does not paint
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 6)
+        self.filter.textChanged.connect(self.proxy.set_filter)
 
     def parse_transactions(self):
-
-        sep = '\t' if self.filename.split('.')[-1] == 'txt' else ';'
-
-        self.transactions = self.load_file(self.filename, sep=sep)
-        self.populate_table(self.transactions.columns)
-
-    def load_file(self, filename, sep):
-        transactions = pd.read_csv(filename, sep)
-       # transactions = transactions.loc[(transactions['Symbol'] == 'WEGE3')].reset_index(drop=True)
-        transactions['Date'] = pd.to_datetime(transactions['Date'], format='%d/%m/%Y')
-
-        if transactions['Date'][0] > transactions['Date'].iloc[-1]:
-            transactions = transactions.iloc[::-1].reset_index(drop=True)
-
-        return transactions
-
-    def populate_table(self, header):
-        trans = self.transactions
-        self.tree.setHeaderLabels(header)
-
-        for i in range(len(trans[list(trans.keys())[0]])):
-            values = {}
-            for k in header:
-                values[k] = trans[k][i]
-
-            item = TransactionItem(self.tree, values, header)
-            self.transaction_items.append(item)
+        """
+        Read the transaction sources (or the selected file), returns the rows appended since the last call or None if
+        the table changed otherwise
+        """
+        specs = self.sources or [{'files': self.filename}]
+        if self.source is None or self.source.specs != specs:
+            self.source = TransactionSources(specs)
+        self.transactions, appended = self.source.read()
+        return appended
+
+    def source_files(self):
+        """Paths of the files read by the last parse_transactions"""
+        return list(self.source.files()) if self.source is not None else []
+
+    def populate_table(self):
+        """Show the parsed transactions, call from the GUI thread"""
+        if self.transactions is not None:
+            self.model.set_transactions(self.transactions)
@@ -16,16 +16,6 @@ class ViewAsset(QWidget):
         super(ViewAsset, self).__init__()
         uic.loadUi(resource_path('ui/view_asset.ui'), self)
         self.history = get_ticker_history(ticker)
-        data = self.history['chart']['result'][0]['indicators']['quote'][0]['close']
-
-        last_value = 0
-        new = []
-        for i in range(len(data)):
-            if data[i] != None:
-                new.append(data[i])
-                last_value = data[i]
-            else:
-                new.append(last_value)
 
         self.setWindowTitle(ticker)
 
@@ -33,9 +23,9 @@ class ViewAsset(QWidget):
 
         self.plot = AssetWidget()
 
-        self.plot.plotItem.setLabel(axis='left', text=self.history['chart']['result'][0]['meta']['currency'])
+        self.plot.plotItem.setLabel(axis='left', text=self.history.currency)
 
-        self.plot_item = PlotCurveItem(self.history['chart']['result'][0]['timestamp'], new, connect='finite', pen=pg.mkPen(color=(0, 0, 0), width=3),name=ticker)
+        self.plot_item = PlotCurveItem(self.history.timestamp, self.history.close, connect='finite', pen=pg.mkPen(color=(0, 0, 0), width=3),name=ticker)
 
         self.plot.addItem(self.plot_item)
 
@@ -1,124 +1,110 @@
-from scipy.interpolate import interp1d
+import numpy as np
+import pandas as pd
 
 from util import *
+from .step_function import StepFunction
 
 TODAY = datetime.datetime.today()
 
 
 class Asset_base():
+    suffix = ''  # Appended to the transaction symbol to get the Yahoo Finance ticker
+    listing_currency = None  # Expected currency of the history, used to prefetch exchange rates
+
+    @classmethod
+    def symbol(cls, ticker):
+        return ticker + cls.suffix
 
     def __init__(self, ticker, transactions, inflation,exchange):
         self.history = get_ticker_history(ticker)
         self.exchange=exchange
-        self.currency=self.history['chart']['result'][0]['meta']['currency']
-        if self.currency != self.exchange.ref_currency:
-            transactions['Total'] = transactions.apply(
-                lambda row: row['Total'] * self.exchange.to_ref(self.currency, row['Date']), axis=1)
+        self.currency=self.history.currency
 
         self.inf = inflation
         self.ticker = ticker
 
-        data = self.history['chart']['result'][0]['indicators']['quote'][0]['close']
-
-        last_value = 0
-        new = []
-        for i in range(len(data)):
-            if data[i] != None:
-                new.append(data[i])
-                last_value = data[i]
-            else:
-                new.append(last_value)
 
-        self.history['chart']['result'][0]['indicators']['quote'][0]['close'] = new  # Fix nones
+        self.transactions = transactions.sort_values('Date', kind='stable').reset_index(drop=True)
+        self._trans_ts = self.transactions['Date'].values.astype('datetime64[ns]').astype(np.int64) / 1e9
 
-        self.transactions = transactions.reset_index(drop=True)
+        quantity = self.transactions['Quantity'].values.astype(np.float64)
+        total = self.transactions['Total'].values.astype(np.float64) * self.exchange.to_ref(self.currency, self._trans_ts)
+        buy = (self.transactions['Order'] == 'Buy').values
+        sell = (self.transactions['Order'] == 'Sell').values
 
+        # Each transaction is scaled by the product of all splits happening after it (half a day margin)
         splits = self.splits()
-        for date_split, val_split in splits.items():
-            self.transactions.loc[self.transactions['Date'] < date_split - datetime.timedelta(days=0.5), 'Quantity'] = (
-                    self.transactions['Quantity'] * val_split).astype(int)
-
-        self.transactions.loc[self.transactions['Order'] == 'Sell', 'Total'] = -1 * self.transactions['Total']
-        self.transactions.loc[self.transactions['Order'] == 'Sell', 'Quantity'] = -1 * self.transactions['Quantity']
-
-        #	quit()
-        qtd = 0
-        invested = 0
-        self.start_date = None
-        for index, row in self.transactions.iterrows():
-
-            if row['Order'] == 'Buy':
-                qtd += row['Quantity']
-                invested += row['Total']
-                if self.start_date == None:
-                    self.start_date = row['Date']
-
-
-            elif row['Order'] == 'Sell':
-                qtd += row['Quantity']
-                invested += row['Total']
-
-            if qtd == 0:
-                invested = 0
-                self.start_date = None
-        if qtd > 0:
-            cps = invested / qtd
-
+        if splits:
+            split_ts = np.array([pd.Timestamp(i).timestamp() - 43200 for i in splits.keys()])
+            order = np.argsort(split_ts)
+            split_ts = split_ts[order]
+            ratios = np.array(list(splits.values()))[order]
+            factors = np.concatenate((np.cumprod(ratios[::-1])[::-1], [1.0]))
+            factor = factors[np.searchsorted(split_ts, self._trans_ts, side='right')]
+            quantity = np.where(factor != 1, np.trunc(quantity * factor), quantity)
+
+        quantity = np.where(sell, -quantity, quantity)
+        total = np.where(sell, -total, total)
+        self.transactions['Quantity'] = quantity
+        self.transactions['Total'] = total
+
+        # Position and cost basis in one cumulative pass, the cost basis restarts whenever the position is closed
+        counted = buy | sell
+        position = np.cumsum(np.where(counted, quantity, 0.0))
+        cost = np.cumsum(np.where(counted, total, 0.0))
+        closed = np.maximum.accumulate(np.where(position == 0, np.arange(len(position)), -1))
+        cost -= np.where(closed >= 0, cost[np.maximum(closed, 0)], 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._cps_acc = np.where(position > 0, cost / position, 0.0)
+
+        self.cps = round(float(self._cps_acc[-1]), 2)
+
+        opened = np.flatnonzero(buy[closed[-1] + 1:])
+        if len(opened):
+            self.start_date = self.transactions['Date'].iloc[closed[-1] + 1 + opened[0]]
         else:
-            cps = 0
-
-        self.cps = round(cps, 2)
-
-        timestamp = [0]
-        qtd_changes = [0]
-        for i in self.transactions['Date']:
-            timestamp.append(i.timestamp())
-            qtd_changes.append(self.qtd_at_date(i))
-        if len(timestamp) > 1:
-            self._qtd = interp1d(timestamp, qtd_changes, kind='previous', fill_value=(0, qtd_changes[-1]),bounds_error=False)
+            self.start_date = None
+
+        # Transaction dates and accumulated totals as arrays, used by the batch queries
+        self._qtd_acc = np.concatenate(([0.0], np.cumsum(quantity)))
+        self._invested_acc = np.concatenate(([0.0], np.cumsum(total)))
+
+        # Cumulative CPI deflated cash flow, the invested value corrected to date d is index_at(d) * _deflated_acc[k]
+        # with k the number of transactions up to d. Inflation is only considered for same base currency assets,
+        # it is already included in exchange prices
+        if self.currency == self.exchange.ref_currency:
+            deflated = total / self.inf.index_at(self._trans_ts)
+            self._deflated_acc = np.concatenate(([0.0], np.cumsum(deflated)))
         else:
-            self._qtd = lambda x: qtd_changes[0]
+            self._deflated_acc = None
 
+        # Quantity step function, one step per transaction date holding the position after the last trade of the day
+        last = np.append(self._trans_ts[1:] != self._trans_ts[:-1], True)
+        timestamp = np.concatenate(([0.0], self._trans_ts[last]))
+        qtd_changes = np.concatenate(([0.0], self._qtd_acc[1:][last]))
+        self._qtd = StepFunction(timestamp, qtd_changes, left=0)
 
-
-        if len(self.history['chart']['result'][0]['timestamp']) > 1:  # Create asset price by time curve for better speed
-            self._price_at_date = interp1d(self.history['chart']['result'][0]['timestamp'],
-                                           self.history['chart']['result'][0]['indicators']['quote'][0]['close'],
-                                           kind='previous', fill_value=(0, self.history['chart']['result'][0]['indicators']['quote'][0]['close'][-1]),
-                                           bounds_error=False)
-        else:
+        timestamps = self.history.timestamp.astype(np.float64)
+        close = self.history.close
+        if len(timestamps) <= 1:
             print('Limited data available for {}'.format(self.ticker))
-            self._price_at_date = lambda x: self.history['chart']['result'][0]['indicators']['quote'][0]['close'][0]
-
-        try:
-
-            a = self.history['chart']['result'][0]['events']['dividends']
 
-            div = {}
-            for value in a.values():
-                div[datetime.datetime.fromtimestamp(value['date'])] = value['amount']
+        # Price history in both currencies, converted once at the asset's own timestamps
+        self._ref_close = close * self.exchange.aligned(self.currency, timestamps)
+        self._price_at_date = StepFunction(timestamps, close, left=0 if len(timestamps) > 1 else None)
+        self._ref_price_at_date = StepFunction(timestamps, self._ref_close, left=0 if len(timestamps) > 1 else None)
 
-            total = 0
-            bb = [0]
-            aa = [0]
-            cc = [0]
-            for date_div, val_div in div.items():
-                qtd = self.qtd(date_div)
+        if len(self.history.div_date):
+            div_ts = self.history.div_date.astype(np.float64)
+            amounts = self.history.div_amount
 
-                aa.append(date_div.timestamp())
-                cc.append(val_div)
-                total += qtd * val_div * self.exchange.to_ref(self.currency,date_div)
-                bb.append(total)
+            received = np.cumsum(self._qtd(div_ts) * amounts * self.exchange.to_ref(self.currency, div_ts))
 
-
-
-            self.pos_acc_div_at_date = interp1d(aa, bb,
-                                                kind='previous', fill_value=(0,bb[-1]),bounds_error=False)
-            self.acc_div_at_date = interp1d(aa, cc,
-                                            kind='previous', fill_value=(0,cc[-1]),bounds_error=False)
-        except Exception as e:
-            self.pos_acc_div_at_date = lambda x: 0
-            self.acc_div_at_date = lambda x: 0
+            self.pos_acc_div_at_date = StepFunction(np.concatenate(([0.0], div_ts)), np.concatenate(([0.0], received)), left=0)
+            self.acc_div_at_date = StepFunction(np.concatenate(([0.0], div_ts)), np.concatenate(([0.0], amounts)), left=0)
+        else:
+            self.pos_acc_div_at_date = StepFunction([0], [0])
+            self.acc_div_at_date = StepFunction([0], [0])
 
     @property
     def net(self):
@@ -126,8 +112,7 @@ class Asset_base():
 
     @property
     def price(self):
-        return round(self.history['chart']['result'][0]['indicators']['quote'][0]['close'][-1] * self.exchange.to_ref(self.currency,
-                                                                                                                      TODAY), 2)
+        return round(float(self._ref_close[-1]), 2)
 
     @property
     def change(self):
@@ -137,35 +122,19 @@ class Asset_base():
         return get_stock_price_live(self.ticker)
 
     def price_at_date(self, date):
-        try:
-            price = round(self._price_at_date(date.timestamp()) * self.exchange.to_ref(self.currency, date), 2)
-        except:
-            price = 0
-        return price
+        return round(self._ref_price_at_date(date.timestamp()), 2)
 
     def splits(self):
-        try:
-            a = self.history['chart']['result'][0]['events']['splits']
-        except:
-            return {}
-        splits = {}
-        for value in a.values():
-            splits[datetime.datetime.fromtimestamp(value['date'])] = value['numerator'] / value['denominator']
-
-        return splits
+        return self.history.splits()
 
     def qtd_at_date(self, date):
 
-        if date >= self.transactions['Date'].min():
-            trans = self.transactions.loc[self.transactions['Date'] <= date].copy()
-            if trans.empty:
-                return 0
+        return float(self._qtd_acc[np.searchsorted(self._trans_ts, pd.Timestamp(date).timestamp(), side='right')])
 
-            a = trans['Quantity'].sum()
-
-            return a
-
-        return 0
+    def cps_at_date(self, date):
+        """Average cost per share of the position held at the input date"""
+        done = np.searchsorted(self._trans_ts, date.timestamp(), side='right')
+        return round(float(self._cps_acc[done - 1]), 2) if done else 0
 
     def qtd(self, date=TODAY):
 
@@ -173,17 +142,14 @@ class Asset_base():
 
     def invested_corrected(self, date):
         """Compensate all transactions with inflation and return the sum up to the input date"""
-        if date >= self.transactions['Date'][0]:
-            if self.qtd(date) > 0:
-                trans = self.transactions.loc[self.transactions['Date'] <= date].copy()
-
-                trans['Total inf'] = trans['Total']
+        ts = date.timestamp()
+        if ts >= self._trans_ts[0] and self.qtd(date) > 0:
+            done = np.searchsorted(self._trans_ts, ts, side='right')
 
-                if self.currency==self.exchange.ref_currency: #Only consider inflation for same base currency asset, inflation is already included in exchange prices
-                    trans['Total inf'] = trans.apply(
-                        lambda row: row['Total'] * (self.inf.inflation_range(row['Date'], date) + 1), axis=1)
+            if self._deflated_acc is not None:
+                return float(self.inf.index_at(ts) * self._deflated_acc[done])
 
-                return trans['Total inf'].sum()
+            return float(self._invested_acc[done])
 
         return 0
 
@@ -191,14 +157,38 @@ class Asset_base():
         if date == None:
             return self.qtd() * self.price
 
-        elif date >= self.transactions['Date'][0]:
-            if self.qtd(date) > 0:
-                trans = self.transactions.loc[self.transactions['Date'] <= date].copy()
-
-                return trans['Total'].sum()
+        ts = date.timestamp()
+        if ts >= self._trans_ts[0] and self.qtd(date) > 0:
+            return float(self._invested_acc[np.searchsorted(self._trans_ts, ts, side='right')])
 
         return 0
 
+    def timeline(self, dates):
+        """
+        Batch version of qtd, price_at_date, dividends, invested and invested_corrected
+
+        dates is an array of timestamps (or a list of datetimes), returns a dict of arrays aligned with it:
+        'Qtd', 'Price' (asset currency), 'Price ref' (reference currency), 'Div', 'Invested' and 'Invested_corr'
+        """
+        ts = to_timestamps(dates)
+
+        qtd = np.broadcast_to(self._qtd(ts), ts.shape).astype(np.float64)
+        price = np.broadcast_to(self._price_at_date(ts), ts.shape).astype(np.float64)
+        price_ref = np.round(np.broadcast_to(self._ref_price_at_date(ts), ts.shape), 2)
+        div = np.round(np.broadcast_to(self.pos_acc_div_at_date(ts), ts.shape).astype(np.float64), 2)
+
+        held = (ts >= self._trans_ts[0]) & (qtd > 0)
+        done = np.searchsorted(self._trans_ts, ts, side='right')
+        invested = np.where(held, self._invested_acc[done], 0.0)
+
+        if self._deflated_acc is not None:
+            invested_corr = np.where(held, self.inf.index_at(ts) * self._deflated_acc[done], 0.0)
+        else:
+            invested_corr = invested
+
+        return {'Qtd': qtd, 'Price': price, 'Price ref': price_ref, 'Div': div, 'Invested': invested,
+                'Invested_corr': invested_corr}
+
     def dividends(self, date=TODAY, pos=True):
         if pos:
             div = self.pos_acc_div_at_date(date.timestamp())
@@ -208,9 +198,7 @@ class Asset_base():
         return round(float(div), 2)
 
     def chart(self):
-        x = self.history['chart']['result'][0]['timestamp']
-        y = self.history['chart']['result'][0]['indicators']['quote'][0]['close']
-        return x, y
+        return self.history.timestamp, self.history.close
 
     def summary(self):
 
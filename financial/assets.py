@@ -5,19 +5,23 @@ from .asset_base import Asset_base
 
 class Stock_BR(Asset_base):
     type = 'BR'
+    listing_currency = 'BRL'
+    suffix = '.SA'
     def __init__(self, ticker, transactions, inflation, exchange):
-        ticker += '.SA'
+        ticker = self.symbol(ticker)
         super(Stock_BR, self).__init__(ticker, transactions, inflation, exchange)
 
 
 class Stock_US(Asset_base):
     type = 'US'
+    listing_currency = 'USD'
     def __init__(self, ticker, transactions, inflation, exchange):
         super(Stock_US, self).__init__(ticker, transactions, inflation, exchange)
 
 
 class REIT(Asset_base):
     type = 'REIT'
+    listing_currency = 'USD'
 
     def __init__(self, ticker, transactions, inflation, exchange):
         super(REIT, self).__init__(ticker, transactions, inflation, exchange)
@@ -25,6 +29,8 @@ class REIT(Asset_base):
 
 class FII(Asset_base):
     type = 'FII'
+    listing_currency = 'BRL'
+    suffix = '.SA'
     def __init__(self, ticker, transactions, inflation, exchange):
-        ticker += '.SA'
+        ticker = self.symbol(ticker)
         super(FII, self).__init__(ticker, transactions, inflation, exchange)
\ No newline at end of file
@@ -1,55 +1,157 @@
 import datetime
 
-from scipy.interpolate import interp1d
+import numpy as np
 
-from util import get_cur_exchange
+from util import get_cur_exchange, cached_pairs, to_timestamps
+from .step_function import StepFunction
 
 TODAY = datetime.datetime.today()
 
 class Exchange():
+    """
+    Conversion rates into a reference currency
+
+    Every series is kept in a pair store (self.pairs, keyed by base + quote currency). Missing pairs are derived from
+    stored or cached ones, by inversion or by triangulation through a common currency, before anything is downloaded.
+    """
+    pivot = 'USD'
+
     def __init__(self, ref_currency):
         self.ref_currency = ref_currency
         self.pairs = {}
+        self.fetched = set()
+        self.derived = {}  # Pair -> pairs it was derived from
+        self._aligned = {}
 
+    def ref_to(self, currency,date=TODAY):
+        """Rate from the reference currency to currency, see to_ref"""
+        return 1 / self.to_ref(currency, date)
 
+    def to_ref(self, currency,date=TODAY):
+        """
+        Rate from currency to the reference currency
 
+        date can be a datetime, returning a float, or a list of datetimes / array of timestamps, returning an array
+        """
+        ts = date.timestamp() if isinstance(date, datetime.datetime) else to_timestamps(date)
 
-
-    def ref_to(self, currency,date=TODAY):
         if currency == self.ref_currency:
-            return 1
+            return 1 if np.ndim(ts) == 0 else np.ones(len(ts))
+
         else:
             if currency + self.ref_currency not in self.pairs.keys():
                 self.add_pair(currency + self.ref_currency)
-            return 1/self.pairs[currency + self.ref_currency](date.timestamp())
+            return self.pairs[currency + self.ref_currency](ts)
 
-    def to_ref(self, currency,date=TODAY):
-        if currency == self.ref_currency:
-            return 1
+    def aligned(self, currency, timestamps):
+        """
+        to_ref rates sampled at an asset's own price timestamps
 
-        else:
-            if currency + self.ref_currency not in self.pairs.keys():
-                self.add_pair(currency + self.ref_currency)
-            return self.pairs[currency + self.ref_currency](date.timestamp())
+        Cached per pair and timestamp array, assets trading on the same calendar share the same series
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        key = (currency, len(timestamps), hash(timestamps.tobytes()))
+        if key not in self._aligned.keys():
+            self._aligned[key] = self.to_ref(currency, timestamps)
+        return self._aligned[key]
 
 
     def add_pair(self,pair):
-
+        """Make pair available in the store, deriving it when possible and downloading it otherwise"""
+        base, quote = pair[:3], pair[3:]
+        cached = set(cached_pairs())  # Listed once for the whole derivation
+
+        if self._leg(base, quote, cached) is not None:
+            return
+
+        pivots = sorted(self.currencies(cached) - {base, quote}, key=lambda i: (i != self.pivot, i))
+        for pivot in pivots:  # Triangulate through any currency with both legs known
+            if self._known(base, pivot, cached) and self._known(pivot, quote, cached):
+                self._derive(pair, [base + pivot, pivot + quote], self._leg(base, pivot, cached),
+                             self._leg(pivot, quote, cached))
+                return
+
+        # Nothing to derive from, when the pivot leg is known download base + pivot instead so that it can be reused
+        # for other reference currencies
+        pivot = self.pivot
+        if pivot not in (base, quote) and self._known(pivot, quote, cached):
+            self.pairs[base + pivot] = self._load(base + pivot)
+            self.fetched.add(base + pivot)
+            self._derive(pair, [base + pivot, pivot + quote], self.pairs[base + pivot], self._leg(pivot, quote, cached))
+            return
+
+        self.pairs[pair] = self._load(pair)
+        self.fetched.add(pair)
+
+    def prefetch_pairs(self, currency):
+        """Cached or missing pairs (get_cur_exchange names) that to_ref(currency) would load, following add_pair"""
+        base, quote = currency, self.ref_currency
+        if base == quote or base + quote in self.pairs.keys():
+            return []
+        cached = set(cached_pairs())
+
+        def source(base, quote):
+            if base + quote in self.pairs.keys() or quote + base in self.pairs.keys():
+                return []
+            return [base + quote] if base + quote in cached else [quote + base]
+
+        if self._known(base, quote, cached):
+            return source(base, quote)
+        pivots = sorted(self.currencies(cached) - {base, quote}, key=lambda i: (i != self.pivot, i))
+        for pivot in pivots:
+            if self._known(base, pivot, cached) and self._known(pivot, quote, cached):
+                return source(base, pivot) + source(pivot, quote)
+        if self.pivot not in (base, quote) and self._known(self.pivot, quote, cached):
+            return [base + self.pivot] + source(self.pivot, quote)
+        return [base + quote]
+
+    def currencies(self, cached):
+        """Currencies found in the store and in the cached pairs"""
+        pairs = set(self.pairs.keys()) | cached
+        return {i[:3] for i in pairs} | {i[3:] for i in pairs}
+
+    def report(self):
+        """Which pairs were downloaded and which were derived, with the pairs they were derived from"""
+        return {'fetched': sorted(self.fetched), 'derived': dict(self.derived)}
+
+    def _known(self, base, quote, cached):
+        """True if base + quote can be obtained without downloading"""
+        known = set(self.pairs.keys()) | cached
+        return base + quote in known or quote + base in known
+
+    def _leg(self, base, quote, cached):
+        """Series for base + quote from the store or the cached pairs, directly or inverted, None if unknown"""
+        pair, inverse = base + quote, quote + base
+        if pair in self.pairs.keys():
+            return self.pairs[pair]
+
+        if inverse not in self.pairs.keys() and pair in cached:
+            self.pairs[pair] = self._load(pair)
+            self.fetched.add(pair)
+            return self.pairs[pair]
+
+        if inverse not in self.pairs.keys() and inverse in cached:
+            self.pairs[inverse] = self._load(inverse)
+            self.fetched.add(inverse)
+
+        if inverse in self.pairs.keys():
+            series = self.pairs[inverse]
+            with np.errstate(divide='ignore'):
+                rates = np.where(series.y != 0, 1 / series.y, 0)
+            self.pairs[pair] = StepFunction(series.x, rates, left=0)
+            self.derived[pair] = [inverse]
+            return self.pairs[pair]
+
+        return None
+
+    def _derive(self, pair, legs, first, second):
+        """Cross rate of two legs (the pairs named in legs), evaluated at the union of both timestamp arrays"""
+        timestamps = np.union1d(first.x, second.x)
+        self.pairs[pair] = StepFunction(timestamps, first(timestamps) * second(timestamps), left=0)
+        self.derived[pair] = legs
+
+    def _load(self,pair):
 
         ex=get_cur_exchange(pair)
-        data = ex[1]
-
-        last_value = 0
-        new = []
-        for i in range(len(data)):
-            if data[i] != None:
-                new.append(data[i])
-                last_value = data[i]
-            else:
-                new.append(last_value)
-
-
-
 
-        self.pairs[pair]=interp1d(ex[0],new, kind='previous', fill_value=(0, new[-1]),
-                                               bounds_error=False)
+        return StepFunction(ex.timestamp.astype(np.float64),ex.close, left=0)
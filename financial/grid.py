@@ -0,0 +1,95 @@
+import numpy as np
+
+from util import to_timestamps
+
+
+class PortfolioGrid():
+    """Dense assets x dates matrices of quantity, price, value, invested, corrected invested and dividends"""
+
+    def __init__(self, assets, dates):
+        self.dates = list(dates)
+        self.tickers = list(assets.keys())
+        self.types = np.array([asset.type for asset in assets.values()])
+        self.cps = np.array([asset.cps for asset in assets.values()], dtype=np.float64)
+
+        self.timestamps = to_timestamps(self.dates)
+
+        shape = (len(self.tickers), len(self.dates))
+        self.qtd = np.zeros(shape)
+        self.price = np.zeros(shape)
+        self.invested = np.zeros(shape)
+        self.invested_corr = np.zeros(shape)
+        self.div = np.zeros(shape)
+
+        for row, asset in enumerate(assets.values()):
+            self.fill(row, asset)
+
+        self.value = self.price * self.qtd
+
+    def fill(self, row, asset, start=0):
+        """Compute one asset row from column start on"""
+        timeline = asset.timeline(self.timestamps[start:])
+        self.qtd[row, start:] = timeline['Qtd']
+        self.price[row, start:] = timeline['Price ref']
+        self.invested[row, start:] = timeline['Invested']
+        self.invested_corr[row, start:] = timeline['Invested_corr']
+        self.div[row, start:] = timeline['Div']
+
+    def update(self, assets, tickers, since):
+        """
+        Recompute the rows of tickers for the dates from timestamp since on, after their assets were rebuilt with
+        transactions from that time. New tickers get a row and rows are put back in the order of assets
+        """
+        new = [i for i in tickers if i not in self.tickers]
+        if new:
+            empty = np.zeros((len(new), len(self.dates)))
+            self.tickers += new
+            for name in ('qtd', 'price', 'invested', 'invested_corr', 'div', 'value'):
+                setattr(self, name, np.vstack((getattr(self, name), empty)))
+
+        start = int(np.searchsorted(self.timestamps, since, side='left'))
+        for ticker in tickers:
+            row = self.tickers.index(ticker)
+            # Rows of new assets are zero before their first transaction, which is not before since
+            self.fill(row, assets[ticker], start)
+            self.value[row] = self.price[row] * self.qtd[row]
+
+        order = [self.tickers.index(i) for i in assets.keys()]
+        if order != list(range(len(self.tickers))):
+            self.tickers = list(assets.keys())
+            for name in ('qtd', 'price', 'invested', 'invested_corr', 'div', 'value'):
+                setattr(self, name, getattr(self, name)[order])
+        self.types = np.array([asset.type for asset in assets.values()])
+        self.cps = np.array([asset.cps for asset in assets.values()], dtype=np.float64)
+
+    def totals(self, rows=slice(None)):
+        """Column sums over the selected asset rows, in the chart_pos format"""
+        return {'Date': self.dates, 'Value': self.value[rows].sum(axis=0), 'Invested': self.invested[rows].sum(axis=0),
+                'Div': self.div[rows].sum(axis=0), 'Invested_corr': self.invested_corr[rows].sum(axis=0)}
+
+    def group_totals(self, groups):
+        """Column sums for several asset types at once, '' stands for all assets. Rows follow the groups order"""
+        membership = np.array([(self.types == group) | (group == '') for group in groups], dtype=np.float64)
+        membership = membership.reshape(len(groups), len(self.tickers))
+        return {'Date': self.dates, 'Value': membership @ self.value, 'Invested': membership @ self.invested,
+                'Div': membership @ self.div, 'Invested_corr': membership @ self.invested_corr}
+
+    def stocks(self):
+        """Per asset series restricted to the dates where it was held, in the chart_stock format"""
+        held = self.qtd > 0
+        first = np.where(held.any(axis=1), held.argmax(axis=1), len(self.dates))
+
+        stocks = {}
+        for row in np.argsort(first, kind='stable'):  # Keep the order in which assets were first held
+            if first[row] == len(self.dates):
+                continue
+            cols = np.flatnonzero(held[row])
+            prices = self.price[row, cols]
+            if self.cps[row] != 0:
+                change = (prices / self.cps[row] - 1) * 100
+            else:
+                change = np.zeros(len(cols))
+            stocks[self.tickers[row]] = {'Total': self.value[row, cols], 'Date': [self.dates[i] for i in cols],
+                                         'Change': change, 'Prices': prices}
+
+        return stocks
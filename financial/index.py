@@ -7,28 +7,30 @@ class Index():
 
 	def __init__(self, index):
 		self.index=index
-		self.history()
+		history = self.history()
+
+		self.timestamps = history.timestamp.astype(np.float64)
+		self.close = history.close
 
 	@property
 	def price(self):
-		return round(self.history()['chart']['result'][0]['indicators']['quote'][0]['close'][-1], 2)
+		return round(float(self.close[-1]), 2)
 
-	@lru_cache(maxsize=128)
 	def history(self):
 
 		return get_ticker_history(self.index)
 
-	def price_at_date(self, date):
-		his = self.history()
-		values, dates = his['chart']['result'][0]['indicators']['quote'][0]['close'], his['chart']['result'][0]['timestamp']
-
-		index = (np.abs(np.array(dates) - date.timestamp())).argmin()
+	def prices_at(self, dates):
+		"""Close at the nearest timestamp of each date, dates is an array of timestamps or a list of datetimes"""
+		ts = to_timestamps(dates)
+		if len(self.timestamps) == 1:
+			return np.full(len(ts), self.close[0])
 
-		if values[index] == None:
-			for i in range(1, 20):
-				a = values[index - i]
-				if a != None:
-					return a
+		right = np.clip(np.searchsorted(self.timestamps, ts), 1, len(self.timestamps) - 1)
+		left = right - 1
+		nearest = np.where(ts - self.timestamps[left] <= self.timestamps[right] - ts, left, right)
+		return self.close[nearest]
 
-		return values[index]
+	def price_at_date(self, date):
 
+		return float(self.prices_at(date)[0])
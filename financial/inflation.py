@@ -1,28 +1,23 @@
 import datetime
 
-from scipy.interpolate import interp1d
-
 from util import get_cpi
 
 
 class Inflation():
 	def __init__(self,reference):
 		if reference=='IPCA':
-			x,y = get_cpi()
-		self.spline=interp1d(x,y,fill_value=(y[0],y[-1]),bounds_error=False)
-		self.today=datetime.datetime.today().timestamp()
+			self.cpi = get_cpi('BR')
+		self.today=datetime.datetime.today()
 
 
 	def inflation_range(self,start,end):
 
-		start=self.spline(start.timestamp())
-		end=self.spline(end.timestamp())
+		return self.cpi.factor(start,end)-1
 
-		return (end-start)/start
+	def index_at(self,timestamps):
+		"""Price index at an array of timestamps"""
+		return self.cpi.at_timestamps(timestamps)
 
 	def acc_inflation(self,start):
-		start=self.spline(start.timestamp())
-		end=self.spline(self.today)
-		return (end-start)/start
-
 
+		return self.cpi.factor(start,self.today)-1
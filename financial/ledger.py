@@ -0,0 +1,419 @@
+"""
+Streaming reader for transaction files
+
+Files are read in chunks with fixed dtypes, Type/Symbol/Order become categoricals and each distinct date string is
+parsed once, so multi-year exports with millions of rows load into a compact table sorted by date. A TransactionFile
+remembers how much of an append-only file was read and parses only the rows added after that, TransactionSources
+merges the files of several brokers and years into one table.
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from market.locks import atomic_write
+
+CHUNK_ROWS = 200000
+DATE_FORMAT = '%d/%m/%Y'
+CATEGORIES = ['Type', 'Symbol', 'Order']
+NUMBERS = ['Quantity', 'Price', 'Total']
+KEY = ['Date', 'Type', 'Symbol', 'Order', 'Quantity', 'Price', 'Total']  # Columns identifying a trade across files
+SHARD_DIR = 'cache/ledger'
+
+
+class DateParser():
+    """Day strings to datetime64[ns], every distinct string is parsed once and remembered"""
+
+    def __init__(self, format=DATE_FORMAT):
+        self.format = format
+        self.days = {}
+
+    def __call__(self, values):
+        codes, uniques = pd.factorize(values)
+        new = [i for i in uniques if i not in self.days]
+        if new:
+            self.days.update(zip(new, pd.to_datetime(new, format=self.format).values))
+        # Missing dates have code -1, which picks the NaT appended at the end
+        table = np.array([self.days[i] for i in uniques] + [np.datetime64('NaT')], dtype='datetime64[ns]')
+        return table[codes]
+
+
+def guess_sep(filename):
+    """Tab for .txt files, semicolon otherwise"""
+    return '\t' if filename.split('.')[-1] == 'txt' else ';'
+
+
+def read_transactions(filename, sep='\t', chunksize=CHUNK_ROWS, date_format=DATE_FORMAT, columns=None):
+    """
+    Transactions DataFrame of a tab/semicolon separated file, sorted by date
+
+    Files in descending date order are reversed (keeping the order of same day rows reversed as well), other files are
+    sorted with a stable sort. columns renames file columns to the known ones ({'Ticker': 'Symbol'}), other columns
+    are kept as read. Quantity is int64 when every quantity of the file is a whole number, float64 otherwise.
+    """
+    columns = columns or {}
+    names = {v: k for k, v in columns.items()}
+    dtype = {'Date': str}
+    dtype.update({i: 'category' for i in CATEGORIES})
+    dtype.update({i: np.float64 for i in NUMBERS})
+    dtype = {names.get(k, k): v for k, v in dtype.items()}
+    parser = DateParser(date_format)
+
+    parts = {}
+    for chunk in pd.read_csv(filename, sep=sep, chunksize=chunksize, dtype=dtype):
+        chunk = chunk.rename(columns=columns)
+        for name in chunk.columns:
+            values = parser(chunk[name].values) if name == 'Date' else chunk[name].values
+            parts.setdefault(name, []).append(values)
+
+    if 'Quantity' in parts and all(np.all(np.mod(i, 1) == 0) for i in parts['Quantity']):  # NaN fails the test
+        parts['Quantity'] = [i.astype(np.int64) for i in parts['Quantity']]
+    return _combine(parts, date_order(np.concatenate(parts['Date'])) if 'Date' in parts else None)
+
+
+def _combine(parts, order=None):
+    """
+    DataFrame of {column: [arrays]}, with order row i is row order[i] of the arrays one after the other
+
+    Every row is written once, straight to its sorted position in a preallocated column, instead of concatenating and
+    then taking the sorted rows. Categoricals are merged with the union of their categories.
+    """
+    rows = sum(len(i) for i in next(iter(parts.values()))) if parts else 0
+    if order is None:
+        position = np.arange(rows)
+    else:  # Row of the result of every input row
+        position = np.empty(rows, dtype=np.int64)
+        position[order] = np.arange(rows)
+
+    columns = {}
+    for name, values in parts.items():
+        if isinstance(values[0], pd.Categorical):
+            categories = values[0].categories
+            for i in values[1:]:
+                categories = categories.union(i.categories, sort=False)
+            codes = np.empty(rows, dtype=_code_type(len(categories)))
+            start = 0
+            for i in values:
+                # Codes of the union, code -1 (missing) picks the -1 appended at the end
+                codes[position[start:start + len(i)]] = np.append(categories.get_indexer(i.categories), -1)[i.codes]
+                start += len(i)
+            columns[name] = pd.Categorical.from_codes(codes, categories=categories)
+        elif not all(isinstance(i, np.ndarray) for i in values):  # Extension arrays, e.g. text of other columns
+            column = pd.concat([pd.Series(i) for i in values], ignore_index=True).array
+            columns[name] = column if order is None else column.take(order)
+        else:
+            column = np.empty(rows, dtype=np.result_type(*values))
+            start = 0
+            for i in values:
+                column[position[start:start + len(i)]] = i
+                start += len(i)
+            columns[name] = column
+    return pd.DataFrame(columns, copy=False)
+
+
+def _code_type(categories):
+    """Integer type pandas keeps the codes of a categorical with this many categories in"""
+    for kind in (np.int8, np.int16, np.int32):
+        if categories < np.iinfo(kind).max:
+            return kind
+    return np.int64
+
+
+def date_order(dates):
+    """Rows sorted by date, a table in descending order is reversed first so same day rows stay in file order"""
+    index = np.arange(len(dates))
+    if len(dates) and dates[0] > dates[-1]:
+        index = index[::-1]
+    return index[np.argsort(dates[index], kind='stable')]
+
+
+def concat(*frames):
+    """Rows of the frames one after the other with the dtypes read_transactions gives, missing columns are NaN"""
+    columns = list(dict.fromkeys(i for frame in frames for i in frame.columns))
+    parts = {}
+    for name in columns:
+        known = next(i for i in frames if name in i.columns)[name].values
+        for frame in frames:
+            if name in frame.columns:
+                values = frame[name].values
+            elif isinstance(known, pd.Categorical):
+                values = pd.Categorical.from_codes(np.full(len(frame), -1), dtype=known.dtype)
+            else:
+                values = np.full(len(frame), np.nan)
+            parts.setdefault(name, []).append(values)
+    return _combine(parts)
+
+
+def merge(shards):
+    """
+    One table of several tables sorted by date, rows of the same day follow the shard order
+
+    The stable sort of the concatenated dates is a timsort, which finds the sorted runs and merges them like a k-way
+    merge. A trade present in several shards (same KEY columns) is kept once: rows are numbered by occurrence of their
+    key within their shard, so repeated identical trades of one file survive while the copies of another file don't.
+    """
+    if len(shards) == 1:
+        return shards[0]
+    table = concat(*shards)
+    shard = np.repeat(np.arange(len(shards)), [len(i) for i in shards])
+
+    key = [i for i in KEY if i in table.columns]
+    occurrence = table[key].assign(_shard=shard).groupby(key + ['_shard'], observed=True, dropna=False,
+                                                         sort=False).cumcount().values
+    duplicate = table[key].assign(_occurrence=occurrence).duplicated().values
+
+    order = np.argsort(table['Date'].values, kind='stable')
+    order = order[~duplicate[order]]
+    return table.take(order).reset_index(drop=True)
+
+
+class TransactionFile():
+    """
+    Transactions of an append-only file
+
+    read parses only the rows added since the previous read. They are recognized by the size and SHA-1 of the part read
+    before, any other change (edited or removed rows, a new header, rows older than the last one) makes it read the
+    whole file again. A file with the same size and modification time isn't opened at all. With a cache path the
+    parsed table survives restarts, the size and modification time are kept in a small file next to it (cache.sig) so
+    a file that was only touched doesn't rewrite the table.
+    """
+
+    def __init__(self, filename, sep='\t', date_format=DATE_FORMAT, columns=None, cache=None):
+        self.filename = filename
+        self.sep = sep
+        self.date_format = date_format
+        self.columns = columns or {}
+        self.cache = cache
+        self.signature = None  # (size, mtime) of the file when it was last read
+        self.offset = 0  # Bytes parsed
+        self.digest = None  # SHA-1 of the first offset bytes
+        self.header = b''
+        self.transactions = None
+
+    @property
+    def options(self):
+        return self.filename, self.sep, self.date_format, self.columns
+
+    def read(self):
+        """
+        Returns (transactions, appended): the whole table sorted by date and the rows added since the previous read,
+        appended is None on the first read and when the whole file was parsed
+        """
+        first = self.transactions is None
+        if first:
+            self.restore()
+
+        stat = os.stat(self.filename)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if self.transactions is not None and signature == self.signature:
+            appended = self.transactions.iloc[:0]
+        else:
+            parsed = (self.offset, self.digest)
+            appended = self.parse()
+            self.signature = signature
+            if (self.offset, self.digest) != parsed:
+                self.store()
+            else:  # Touched but unchanged, the stored table is still right
+                self.store_signature()
+        return self.transactions, None if first else appended
+
+    def parse(self):
+        """Parse the rows after offset if the file still starts with the bytes read before, else the whole file"""
+        with open(self.filename, 'rb') as infile:
+            if self.transactions is not None and os.fstat(infile.fileno()).st_size >= self.offset:
+                digest = _digest(infile, self.offset)
+                if digest.hexdigest() == self.digest:
+                    infile.seek(self.offset)
+                    tail = infile.read()
+                    appended = self.parse_tail(tail)
+                    if appended is not None:
+                        digest.update(tail)
+                        self.digest = digest.hexdigest()
+                        return appended
+
+            infile.seek(0)
+            content = infile.read()
+
+        self.transactions = read_transactions(io.BytesIO(content), sep=self.sep, date_format=self.date_format,
+                                              columns=self.columns)
+        self.header = content[:content.find(b'\n') + 1]
+        self.offset = len(content)
+        self.digest = hashlib.sha1(content).hexdigest()
+        return None
+
+    def parse_tail(self, tail):
+        """Append the rows in tail (the bytes after offset), returns them or None if they can't be appended"""
+        if not tail.strip():
+            self.offset += len(tail)
+            return self.transactions.iloc[:0]
+
+        appended = read_transactions(io.BytesIO(self.header + tail), sep=self.sep, date_format=self.date_format,
+                                     columns=self.columns)
+        if list(appended.columns) != list(self.transactions.columns):
+            return None
+        if len(self.transactions) and appended['Date'].values[0] < self.transactions['Date'].values[-1]:
+            return None
+
+        self.transactions = concat(self.transactions, appended)
+        self.offset += len(tail)
+        return appended.set_axis(np.arange(len(self.transactions) - len(appended), len(self.transactions)))
+
+    def store(self):
+        if self.cache is None:
+            return
+        os.makedirs(os.path.dirname(self.cache) or '.', exist_ok=True)
+        with atomic_write(self.cache, 'wb') as outfile:
+            pickle.dump({'options': self.options, 'signature': self.signature, 'offset': self.offset,
+                         'digest': self.digest, 'header': self.header, 'transactions': self.transactions}, outfile)
+        self.store_signature()
+
+    def store_signature(self):
+        """Write the file signature with the offset and digest of the stored table it belongs to"""
+        if self.cache is None:
+            return
+        with atomic_write(self.cache + '.sig') as outfile:
+            json.dump({'signature': self.signature, 'offset': self.offset, 'digest': self.digest}, outfile)
+
+    def restore(self):
+        """Load the table parsed by an earlier run, if it was read with the same options"""
+        if self.cache is None:
+            return
+        try:
+            with open(self.cache, 'rb') as infile:
+                state = pickle.load(infile)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return
+        if state.get('options') != self.options:
+            return
+        self.signature, self.offset, self.digest = state['signature'], state['offset'], state['digest']
+        self.header, self.transactions = state['header'], state['transactions']
+        try:
+            with open(self.cache + '.sig', 'r') as infile:
+                signature = json.load(infile)
+        except (OSError, ValueError):
+            return
+        if (signature.get('offset'), signature.get('digest')) == (self.offset, self.digest):
+            self.signature = tuple(signature['signature'])
+
+
+class TransactionSources():
+    """
+    Transactions of several files merged into one table
+
+    specs is a list of {'files': path or glob pattern, 'sep': separator (by extension when missing), 'columns':
+    {file column: column}, 'date_format': date format}. Matching files are parsed in parallel into shards that are kept
+    in memory and in cache/ledger, so unchanged files are not read again, and merged by date without duplicates.
+    """
+
+    def __init__(self, specs, cache=SHARD_DIR, workers=4):
+        self.specs = specs
+        self.cache = cache
+        self.workers = workers
+        self.shards = {}  # Path -> TransactionFile
+        self.transactions = None
+
+    def files(self):
+        """{path: spec} of the files matched by the specs, in spec and name order. A file matched twice uses the first"""
+        files = {}
+        for spec in self.specs:
+            pattern = os.path.expanduser(spec['files'])
+            paths = sorted(glob.glob(pattern)) if any(i in pattern for i in '*?[') else [pattern]
+            for file_path in paths:
+                files.setdefault(os.path.abspath(file_path), spec)
+        return files
+
+    def shard(self, file_path, spec):
+        options = (file_path, spec.get('sep') or guess_sep(file_path), spec.get('date_format', DATE_FORMAT),
+                   spec.get('columns') or {})
+        shard = self.shards.get(file_path)
+        if shard is None or shard.options != options:
+            cache = None
+            if self.cache is not None:
+                cache = os.path.join(self.cache, hashlib.sha1(file_path.encode()).hexdigest()[:16] + '.pkl')
+            shard = TransactionFile(file_path, sep=options[1], date_format=options[2], columns=options[3], cache=cache)
+        return shard
+
+    def read(self):
+        """
+        Returns (transactions, appended) like TransactionFile.read, appended is None whenever the table is not the
+        previous one followed by new rows
+        """
+        files = self.files()
+        if not files:
+            raise FileNotFoundError('No transaction files match {}'.format([i['files'] for i in self.specs]))
+        shards = {file_path: self.shard(file_path, spec) for file_path, spec in files.items()}
+        same = list(shards.items()) == list(self.shards.items()) and self.transactions is not None
+        self.shards = shards
+
+        with ThreadPoolExecutor(min(self.workers, len(shards))) as pool:
+            results = list(pool.map(lambda shard: shard.read(), shards.values()))
+
+        if len(results) == 1:
+            appended = results[0][1] if same else None
+            self.transactions = results[0][0]
+            return self.transactions, appended
+
+        if same and all(i[1] is not None and not len(i[1]) for i in results):
+            return self.transactions, self.transactions.iloc[:0]
+
+        transactions = merge([i[0] for i in results])
+        appended = _appended(self.transactions, transactions) if same else None
+        self.transactions = transactions
+        return transactions, appended
+
+
+def _appended(old, new):
+    """Rows of new after the rows of old, None if new doesn't start with old"""
+    if len(new) < len(old) or list(new.columns) != list(old.columns):
+        return None
+    for name in old.columns:
+        first, second = old[name], new[name].iloc[:len(old)]
+        if isinstance(first.dtype, pd.CategoricalDtype) or isinstance(second.dtype, pd.CategoricalDtype):
+            first, second = first.astype(object), second.astype(object)
+        if not first.equals(second):
+            return None
+    return new.iloc[len(old):]
+
+
+def _digest(infile, size, block=1 << 20):
+    """SHA-1 object fed with the first size bytes of an open binary file"""
+    infile.seek(0)
+    digest = hashlib.sha1()
+    while size > 0:
+        data = infile.read(min(block, size))
+        if not data:
+            break
+        digest.update(data)
+        size -= len(data)
+    return digest
+
+
+def partition(transactions, column='Symbol'):
+    """
+    {value: rows} of transactions split by one column with a single stable sort
+
+    Each part is a contiguous slice of the sorted table (a view, rows keep their original order and index), missing
+    values are left out. Parts are ordered by value.
+    """
+    values = transactions[column].values
+    if isinstance(values, pd.Categorical):
+        codes, uniques = values.codes, values.categories
+    else:
+        codes, uniques = pd.factorize(values, sort=True)
+
+    order = np.argsort(codes, kind='stable')
+    ordered = transactions.take(order)
+    codes = codes[order]
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(codes)]))
+
+    parts = {uniques[codes[start]]: ordered.iloc[start:end] for start, end in zip(starts, ends)
+             if len(codes) and codes[start] >= 0}
+    return {i: parts[i] for i in sorted(parts)}
@@ -1,14 +1,21 @@
+from concurrent.futures import as_completed
 from datetime import datetime
 from datetime import timedelta
 from functools import lru_cache
 
+import numpy as np
+import pandas as pd
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QObject
 
 from financial.assets import Stock_BR, Stock_US, REIT, FII
 from financial.exchange import Exchange
+from financial.grid import PortfolioGrid
 from financial.index import Index
 from financial.inflation import Inflation
-from util import get_date_range
+from financial.ledger import partition
+from market import quotes
+from market.prefetch import Prefetcher
+from util import CHART_HOST, get_cur_exchange, get_date_range, get_ticker_history, to_timestamps
 
 
 class Portfolio(QObject):
@@ -24,69 +31,168 @@ class Portfolio(QObject):
         self.ibov = Index('%5EBVSP')
         self.sp500 = Index('%5EGSPC')
         self.cache = {}
+        self.grids = {}  # Range in months (None for the whole history) -> PortfolioGrid
+        self.symbol_types = {}  # Symbol -> types it is listed under, in self.types order
         self.types = {'BR': Stock_BR, 'US': Stock_US, 'FII': FII, 'REIT': REIT}
 
     @pyqtSlot()
     def load_transactions(self, transactions):
-        self.assets = {}
+        self.invalidate()
         self.transactions = transactions
+        self.symbol_types = {}
         self.status('Loading transactions')
-        for type, asset in self.types.items():
-            tran = transactions.loc[transactions['Type'] == type]
-            if not tran.empty:
-                self.assets.update(
-                    {i: asset(i, transactions.loc[(transactions['Symbol'] == i)].copy(), self.inflation, self.exchange) for i in set(tran['Symbol'])})
+
+        # One sort splits the table into per symbol slices
+        self.assets = self.build_assets(partition(transactions, 'Symbol'))
+
+    def append_transactions(self, transactions, appended):
+        """
+        Update the portfolio with rows appended to its transactions, transactions is the whole table with them
+
+        Only the assets of the appended symbols are rebuilt and the cached grids are patched from the first appended
+        date on. Rows dated before the portfolio start need new date ranges and reload everything, grids whose dates
+        end before the appended rows or before today are dropped (see drop_stale).
+        """
+        if not len(appended):
+            return self.drop_stale()
+        first = appended['Date'].min()
+        if self.transactions is None or not len(self.transactions) or first < self.start_date:
+            return self.load_transactions(transactions)
+
+        self.transactions = transactions
+        self.status('Loading transactions')
+        symbols = set(appended['Symbol'].dropna())
+        built = self.build_assets(partition(transactions.loc[transactions['Symbol'].isin(symbols)], 'Symbol'))
+        assets = dict(self.assets)
+        assets.update(built)
+        self.assets = {i: assets[i] for i in self.ordered(assets.keys())}
+
+        since = pd.Timestamp(first).timestamp()
+        self.drop_stale(since)
+        for key, grid in self.grids.items():
+            grid.update(self.assets, list(built.keys()), since)
+            if key is not None:
+                self.cache[key].update(self.group_rentability(grid))
+        self.clear_charts()
+
+    def build_assets(self, parts):
+        """
+        Assets of {symbol: transactions}, ordered by type then symbol. A symbol listed under several types is placed
+        with the first one and built as the last one
+        """
+        for symbol, rows in parts.items():
+            listed = set(rows['Type']).union(self.symbol_types.get(symbol, []))
+            self.symbol_types[symbol] = [i for i in self.types if i in listed]
+        classes = {i: self.types[self.symbol_types[i][-1]] for i in self.ordered(parts.keys())}
+
+        # Histories and the exchange rates their listing currencies need are downloaded concurrently, each asset is built
+        # as soon as its own data is ready. An asset in another currency resolves its rate when it is built
+        self.status('Downloading market data')
+        pairs = sorted({pair for asset in set(classes.values()) if asset.listing_currency for pair in
+                        self.exchange.prefetch_pairs(asset.listing_currency)})
+        assets = {}
+        with Prefetcher(host_limits={CHART_HOST: 4}) as prefetch:
+            for pair in pairs:
+                prefetch.submit(CHART_HOST, get_cur_exchange, pair)
+            pending = {prefetch.submit(CHART_HOST, get_ticker_history, asset.symbol(i)): i for i, asset in classes.items()}
+            for future in as_completed(pending):
+                ticker = pending[future]
+                currency = future.result().currency
+                self.exchange.to_ref(currency)  # Resolve the currency pair before building the asset
+                assets[ticker] = classes[ticker](ticker, parts[ticker], self.inflation, self.exchange)
+
+        return {i: assets[i] for i in classes.keys()}
+
+    def ordered(self, symbols):
+        """Symbols with a known type, by first type then name"""
+        order = list(self.types.keys())
+        return sorted((i for i in symbols if self.symbol_types.get(i)),
+                      key=lambda i: (order.index(self.symbol_types[i][0]), i))
+
+    def invalidate(self):
+        """Forget every result computed from the assets"""
+        self.grids = {}
+        self.cache = {}
+        self.clear_charts()
+
+    def drop_stale(self, since=None):
+        """
+        Forget the grids, and the results computed from them, whose dates end before the last weekday or before
+        timestamp since. Their date range is computed again when they are next used, so the charts and the 1m/6m/12m
+        windows move with the days
+        """
+        today = datetime.today()
+        end = (today - timedelta(days=max(0, today.weekday() - 4))).date()  # Weekends end on Friday
+        stale = [key for key, grid in self.grids.items() if
+                 grid.dates[-1].date() < end or since is not None and since > grid.timestamps[-1]]
+        for key in stale:
+            del self.grids[key]
+            self.cache.pop(key, None)
+        if stale:
+            self.clear_charts()
+
+    def clear_charts(self):
+        """Forget the chart and summary results, they are quick reductions of the grids"""
+        # The lru caches belong to the class, there is a single portfolio
+        Portfolio.chart_stock.cache_clear()
+        Portfolio.chart_pos.cache_clear()
+        Portfolio.get_pos.cache_clear()
+        Portfolio.get_rentability_data.cache_clear()
+
+    def live_symbols(self):
+        """Yahoo symbols of the held assets, the benchmark indexes and the currency pairs in use"""
+        return [asset.ticker for asset in self.assets.values()] + [self.ibov.index, self.sp500.index] + [
+            i + '=X' for i in sorted(self.exchange.fetched)]
+
+    def refresh_quotes(self):
+        """Live quotes of every live symbol in a few batched requests, kept for price_live and live_value"""
+        return quotes.service.get(self.live_symbols())
+
+    def subscribe_quotes(self, callback):
+        """callback(changes) receives the live quotes that changed on each quotes.service.poll()"""
+        return quotes.service.subscribe(self.live_symbols(), callback)
+
+    def live_value(self):
+        """
+        Value of the current positions in the reference currency at the live quotes (see refresh_quotes), assets
+        without a quote are valued at their last close and currencies without a live pair at the last cached rate.
+        May download, call it outside the GUI thread
+        """
+        live = self.refresh_quotes()
+        total = 0
+        for asset in self.assets.values():
+            qtd = asset.qtd()
+            if qtd <= 0:
+                continue
+            quote = live.get(asset.ticker)
+            if quote is None:
+                total += qtd * asset.price
+                continue
+            pair = live.get(asset.currency + self.exchange.ref_currency + '=X')
+            rate = pair.price if pair is not None else self.exchange.to_ref(asset.currency, datetime.today())
+            total += qtd * quote.price * rate
+        return round(total, 2)
 
     @property
     def start_date(self):
 
         return self.transactions['Date'][0]
 
+    def grid(self):
+        """Assets x dates matrices over the whole portfolio history, shared by the charts"""
+        if None not in self.grids:
+            self.grids[None] = PortfolioGrid(self.assets, get_date_range(self.start_date, datetime.today()))
+        return self.grids[None]
+
     @lru_cache(maxsize=None)
     def chart_stock(self):
 
-        dates = get_date_range(self.start_date, datetime.today())
-        stocks = {}
-
-        for date in dates:
-            for ticker, stock in self.assets.items():
-                if stock.qtd(date) > 0:
-                    if ticker not in stocks.keys():
-                        stocks[ticker] = {'Total': [], 'Date': [], 'Change': [], 'Prices': []}
-                    if stock.cps != 0:
-                        stocks[ticker]['Change'].append((stock.price_at_date(date) / stock.cps - 1) * 100)
-                    else:
-                        stocks[ticker]['Change'].append(0)
-                    stocks[ticker]['Prices'].append(stock.price_at_date(date))
-                    stocks[ticker]['Total'].append(stock.price_at_date(date) * stock.qtd(date))
-                    stocks[ticker]['Date'].append(date)
-
-        return stocks
+        return self.grid().stocks()
 
     @lru_cache(maxsize=None)
     def chart_pos(self):
 
-        dates = get_date_range(self.start_date, datetime.today())
-
-        total = {'Date': [], 'Value': [], 'Invested': [], 'Div': [], 'Invested_corr': []}
-
-        for date in dates:
-            value = 0
-            invested = 0
-            invested_corr = 0
-            div = 0
-            for ticker, stock in self.assets.items():
-                div += stock.dividends(date)
-                value += stock.price_at_date(date) * stock.qtd(date)
-                invested += stock.invested(date)  # Sum of transactions, not cps*qtd
-                invested_corr += stock.invested_corrected(date)
-            total['Invested_corr'].append(invested_corr)
-            total['Invested'].append(invested)
-            total['Value'].append(value)
-            total['Div'].append(div)
-            total['Date'].append(date)
-
-        return total
+        return self.grid().totals()
 
     @lru_cache(maxsize=None)
     def get_pos(self):
@@ -100,65 +206,62 @@ class Portfolio(QObject):
 
     @pyqtSlot()
     def rentability(self, range_months):
-        types = ['', 'US', 'BR', 'FII']
 
-        if str(range_months) in self.cache.keys():  # Store results
+        total_months = int((datetime.today() - self.start_date).days / (365 / 12))
+        if range_months == 0 or range_months > total_months:
+            range_months = total_months
+
+        if str(range_months) in self.cache.keys():  # Store results, 'Total' and its month count share one entry
             return self.cache[str(range_months)]
 
-        if range_months == 0:
+        if range_months == total_months:
             self.status('Calculating total rentability')
-            range_months = 120000
         else:
             self.status('Calculating rentability for {} months'.format(range_months))
 
-        if range_months > int((datetime.today() - self.start_date).days / (365 / 12)):
-            range_months = int((datetime.today() - self.start_date).days / (365 / 12))
-
         start_date = datetime.today() - timedelta(days=range_months * 365 / 12)
         dates = get_date_range(start_date, datetime.today())
-        data = {i: [] for i in
-                ['DATE', 'RENT IPCA ', 'RENT ', 'RENT IPCA FII', 'RENT FII', 'RENT BR', 'RENT US', 'RENT IPCA BR',
-                 'RENT IPCA US', 'IBOV', 'SP500', 'IPCA']}
-
-        ibov0 = self.ibov.price_at_date(dates[0])
-        sp500 = self.sp500.price_at_date(dates[0])
-        for date in dates:
-            data['IBOV'].append(100 * (self.ibov.price_at_date(date) - ibov0) / ibov0)
-            data['SP500'].append(100 * (self.sp500.price_at_date(date) - sp500) / sp500)
-            inf = self.inflation.inflation_range(start_date, date)
-            data['IPCA'].append(100 * inf)
-            data['DATE'].append(date)
-
-        for TYP in types:
-            init, init_inf = 0, 0
-            first = True
-            for date in dates:
-                value = 0
-                invested = 0
-                invested_corr = 0
-                div = 0
-                for stock in self.assets.values():
-                    if stock.type == TYP or TYP == '':
-                        qtd = stock.qtd(date)
-                        div += stock.dividends(date)
-                        value += stock.price_at_date(date) * qtd
-                        invested += stock.invested(date)  # Sum of transactions, not cps*qtd
-                        invested_corr += stock.invested_corrected(date)
-
-                if first and invested > 0:
-                    init = (value + div) / invested - 1
-                    first = False
-                    init_inf = (value + div) / invested_corr - 1
-
-                if invested > 0:
-
-                    data['RENT {}'.format(TYP)].append(100 * ((value + div) / invested - 1 - init))
-                    data['RENT IPCA {}'.format(TYP)].append(100 * ((value + div) / invested_corr - 1 - init_inf))
-                else:
-                    data['RENT {}'.format(TYP)].append(0)
-                    data['RENT IPCA {}'.format(TYP)].append(0)
+        data = {'DATE': dates}
+
+        timestamps = to_timestamps(dates)
+        ibov = self.ibov.prices_at(timestamps)
+        sp500 = self.sp500.prices_at(timestamps)
+        data['IBOV'] = 100 * (ibov - ibov[0]) / ibov[0]
+        data['SP500'] = 100 * (sp500 - sp500[0]) / sp500[0]
+        cpi = self.inflation.index_at(timestamps)
+        data['IPCA'] = 100 * (cpi / self.inflation.index_at(start_date.timestamp()) - 1)
+
+        # Per asset values are computed once for the range, the grid is kept to patch it when transactions are added
+        grid = PortfolioGrid(self.assets, dates)
+        data.update(self.group_rentability(grid))
+
+        order = ['DATE', 'RENT IPCA ', 'RENT ', 'RENT IPCA FII', 'RENT FII', 'RENT BR', 'RENT US', 'RENT IPCA BR',
+                 'RENT IPCA US', 'RENT REIT', 'RENT IPCA REIT', 'IBOV', 'SP500', 'IPCA']
+        data = {i: data[i] for i in order}
 
         self.cache[str(range_months)] = data
+        self.grids[str(range_months)] = grid
+        return data
+
+    @staticmethod
+    def group_rentability(grid):
+        """'RENT <type>' and 'RENT IPCA <type>' series of a grid, all groups reduced together"""
+        groups = ['', 'US', 'BR', 'FII', 'REIT']
+        totals = grid.group_totals(groups)
+        value = totals['Value'] + totals['Div']
+
+        data = {}
+        for row, TYP in enumerate(groups):
+            rent = np.zeros(len(grid.dates))
+            rent_inf = np.zeros(len(grid.dates))
+            active = totals['Invested'][row] > 0
+            if active.any():
+                ratio = value[row, active] / totals['Invested'][row, active] - 1
+                ratio_inf = value[row, active] / totals['Invested_corr'][row, active] - 1
+                rent[active] = 100 * (ratio - ratio[0])
+                rent_inf[active] = 100 * (ratio_inf - ratio_inf[0])
+            data['RENT {}'.format(TYP)] = rent
+            data['RENT IPCA {}'.format(TYP)] = rent_inf
         return data
 
     @lru_cache(maxsize=None)
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class StepFunction():
+    """
+    Piecewise function over sorted NumPy arrays, evaluated with np.searchsorted
+
+    kind='previous' holds the last value at or before x (like interp1d(kind='previous')), kind='linear' interpolates.
+    Values before the first point are left and after the last point are right, both default to the edge values.
+    Scalars return a float and arrays return an array of the same shape.
+    """
+    __slots__ = ('x', 'y', 'kind', 'left', 'right')
+
+    def __init__(self, x, y, kind='previous', left=None, right=None):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if np.any(x[1:] < x[:-1]):
+            order = np.argsort(x, kind='stable')
+            x, y = x[order], y[order]
+
+        self.x = x
+        self.y = y
+        self.kind = kind
+        self.left = float(y[0]) if left is None else float(left)
+        self.right = float(y[-1]) if right is None else float(right)
+
+    def __call__(self, x):
+        values = np.asarray(x, dtype=np.float64)
+
+        if self.kind == 'linear':
+            out = np.interp(values, self.x, self.y, left=self.left, right=self.right)
+        else:
+            index = np.searchsorted(self.x, values, side='right') - 1
+            out = np.where(index >= 0, self.y[np.maximum(index, 0)], self.left)
+            out = np.where(values > self.x[-1], self.right, out)
+
+        if out.ndim == 0:
+            return float(out)
+        return out
+
+    def __reduce__(self):
+        return self.__class__, (self.x, self.y, self.kind, self.left, self.right)
+
+    def __len__(self):
+        return len(self.x)
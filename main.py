@@ -23,6 +23,7 @@ pg.setConfigOption('antialias', True)  # Set to False if there is too much lag w
 from plotting.plot_widget import PlotWidget
 from thread import Thread
 from elements.view_asset import ViewAsset
+from market import quotes
 
 
 class MainWindow(QMainWindow):
@@ -38,6 +39,7 @@ class MainWindow(QMainWindow):
 
         self.datafile = self.config['defaultfile']
         self.transaction_window = Transactions(self)
+        self.transaction_window.sources = self.config.get('sources')
         self.portfolio = Portfolio(self.config)
         self.portfolio.signalStatus.connect(lambda x: self.statusBar().showMessage(x, 100000))
         self.bottompanel = BottomPanel()
@@ -49,8 +51,19 @@ class MainWindow(QMainWindow):
         self.upper_grid.addWidget(self.plot)
         self.thr = None
         self.view = None
-
-        if exists(self.datafile):
+        self.quote_thread = None
+        self.subscription = None
+        self.quote_timer = QtCore.QTimer(self)
+        self.quote_timer.timeout.connect(self.poll_quotes)
+        # Changed transaction files are read again, once the writes of an editor or export settled
+        self.reload_timer = QtCore.QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(1000)
+        self.reload_timer.timeout.connect(self.reload_transactions)
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(lambda file_path: self.reload_timer.start())
+
+        if self.config.get('sources') or exists(self.datafile):
             self.update_thread()
         else:
             self.statusBar().showMessage('Please select transactions file to begin', 100000)
@@ -60,14 +73,57 @@ class MainWindow(QMainWindow):
         Updates UI elements after update thread finishes processing all transactions
 
         """
+        self.transaction_window.populate_table()
         self.bottompanel.update_data(self.portfolio.get_pos(), self.portfolio.get_rentability_data())
         self.bottompanel.show()
         self.frame.setDisabled(False)
 
+        # Files replaced by a rename drop out of the watcher, the watched list is set again after every read
+        if self.watcher.files():
+            self.watcher.removePaths(self.watcher.files())
+        if self.transaction_window.source_files():
+            self.watcher.addPaths(self.transaction_window.source_files())
+
+        # Symbols change with the transactions, the live valuation follows the new subscription
+        if self.subscription is not None:
+            quotes.service.unsubscribe(self.subscription)
+        self.subscription = self.portfolio.subscribe_quotes(None)
+        self.quote_timer.start(quotes.TTL * 1000)
+
+    def poll_quotes(self):
+        """Refresh the live quotes in a thread, the overview value is updated when a price changed"""
+        if self.quote_thread is not None and self.quote_thread.isRunning():
+            return
+        self.quote_thread = Thread(self.fetch_quotes, None)
+        self.quote_thread.signalStatus.connect(self.show_quotes)
+        self.quote_thread.start()
+
+    def fetch_quotes(self):
+        """Poll the subscribed quotes and value the portfolio with them, returns (value, invested) if a price changed"""
+        try:
+            if quotes.service.poll().get(self.subscription):
+                # Served from the quotes just polled, the portfolio isn't reloaded while the timer runs
+                return self.portfolio.live_value(), self.portfolio.get_rentability_data()['SUMMARY']['Invested']
+        except Exception as e:
+            print('Live quotes unavailable: {}'.format(e))
+
+    def show_quotes(self, a):
+        if not self.quote_thread.result:
+            return
+        value, invested = self.quote_thread.result
+        if 'Value' in self.bottompanel.summary_labels:
+            self.bottompanel.summary_labels['Value'].setText(str(round(value, 2)))
+            self.bottompanel.summary_labels['Net'].setText(str(round(value - invested, 2)))
+        self.statusBar().showMessage('Live value {}'.format(round(value, 2)), 10000)
+
     def update_thread(self):
         """
         Processes all heavy tasks inside a thread, tasks are defined in self.update_data
         """
+        # Live valuation pauses while the portfolio is rebuilt, done starts it again
+        self.quote_timer.stop()
+        if self.quote_thread is not None:
+            self.quote_thread.wait()
 
         self.thr = Thread(self.update_data, None)
         self.thr.signalStatus.connect(self.done)
@@ -79,6 +135,7 @@ class MainWindow(QMainWindow):
         uic.loadUi(resource_path('ui/ui.ui'), self)
         self.setWindowIcon(QtGui.QIcon(resource_path('ui/icon.ico')))
         self.MainMenu.addAction("Open transactions file", self.open_transactions)
+        self.MainMenu.addAction("Reload transactions", self.reload_transactions)
         self.MainMenu.addAction("Transactions", lambda: self.transaction_window.show())
         self.MainMenu.addAction("View asset", lambda: self.view_asset())
         self.MainMenu.addAction("Information", lambda: self.view_information())
@@ -103,6 +160,7 @@ class MainWindow(QMainWindow):
 
         file = QtWidgets.QFileDialog.getOpenFileName(self, 'Select transactions file')[0]
         self.datafile = file
+        self.transaction_window.sources = None  # An explicitly opened file replaces the configured sources
         print('Open {}'.format(self.datafile))
         if exists(self.datafile):
             self.update_thread()
@@ -110,13 +168,29 @@ class MainWindow(QMainWindow):
             print('File path {} is not valid'.format(self.datafile))
 
 
+    def reload_transactions(self):
+        """Read the current transaction file or sources again, appended rows only rebuild their own assets"""
+        if self.thr is not None and self.thr.isRunning():
+            self.reload_timer.start()  # Again once the running update is done
+            return
+        self.update_thread()
+
     def update_data(self):
         """Tasks to be performed inside a thread, do not update gui elements here"""
 
         self.transaction_window.filename = self.datafile
-        self.transaction_window.parse_transactions()
+        appended = self.transaction_window.parse_transactions()
+
+        # Rows appended to the file only rebuild their own assets
+        if appended is None:
+            self.portfolio.load_transactions(self.transaction_window.transactions)
+        else:
+            self.portfolio.append_transactions(self.transaction_window.transactions, appended)
 
-        self.portfolio.load_transactions(self.transaction_window.transactions)
+        try:  # One batched round for the whole book, the live valuation is served from it
+            self.portfolio.refresh_quotes()
+        except Exception as e:
+            print('Live quotes unavailable: {}'.format(e))
 
         portfolio = self.portfolio.chart_pos()
 
@@ -0,0 +1,191 @@
+"""
+Local store of monthly consumer price indexes
+
+Values are kept by (source, month) in cache/cpi.json, an update only asks the source for the months after the last
+stored one. Both sources publish a chained index, so the inflation between two months is the ratio of their values
+and a CpiSeries answers it with two array lookups.
+"""
+import datetime
+import json
+import threading
+from os import path
+
+import numpy as np
+
+from market.locks import FileLock, atomic_write
+
+IBGE_URL = 'https://servicodados.ibge.gov.br/api/v3/agregados/1737/periodos/{}/variaveis/2266?localidades=N1[all]'
+BLS_URL = 'https://api.bls.gov/publicAPI/v1/timeseries/data/'
+FIRST_MONTH = {'IBGE': '197912', 'BLS': '191301'}
+IBGE_CHUNK = 120  # Months per IBGE request, they are listed in the URL
+BLS_YEARS = 10  # Longest span the BLS API answers in one request
+
+
+def month_number(date):
+    """Months since year 0 of a datetime or a 'YYYYMM' string"""
+    if isinstance(date, str):
+        return int(date[:4]) * 12 + int(date[4:6]) - 1
+    return date.year * 12 + date.month - 1
+
+
+def month_key(number):
+    return '{}{:02d}'.format(number // 12, number % 12 + 1)
+
+
+def month_start(number):
+    return datetime.datetime(number // 12, number % 12 + 1, 1)
+
+
+def fetch_ibge(first, last, get_json):
+    """IPCA index values from month number first to last (inclusive), months not published yet are missing"""
+    values = {}
+    for start in range(first, last + 1, IBGE_CHUNK):
+        periods = '%7C'.join(month_key(i) for i in range(start, min(start + IBGE_CHUNK, last + 1)))
+        serie = get_json(IBGE_URL.format(periods))[0]['resultados'][0]['series'][0]['serie']
+        values.update({k: float(v) for k, v in serie.items() if _is_number(v)})
+    return values
+
+
+def fetch_bls(first, last, post_json):
+    """CPI-U index values from month number first to last (inclusive), months not published yet are missing"""
+    values = {}
+    for year in range(first // 12, last // 12 + 1, BLS_YEARS):
+        data = {'seriesid': ['CUUR0000SA0'], 'startyear': str(year), 'endyear': str(min(year + BLS_YEARS - 1, last // 12))}
+        response = post_json(BLS_URL, data)
+        if response['status'] != 'REQUEST_SUCCEEDED':
+            raise Exception('Request failed {}'.format(response['message']))
+        for i in response['Results']['series'][0]['data']:
+            key = i['year'] + i['period'][1:]
+            if i['period'] != 'M13' and first <= month_number(key) <= last and _is_number(i['value']):
+                values[key] = float(i['value'])
+    return values
+
+
+class CpiSeries():
+    """
+    Contiguous monthly index of one source
+
+    index[i] is the value of month first + i (months missing at the source repeat the previous one), timestamps are
+    the local month starts. Values between month starts are interpolated linearly and clamped outside the series.
+    """
+    __slots__ = ('source', 'first', 'index', 'timestamps')
+
+    def __init__(self, source, months):
+        numbers = sorted(month_number(i) for i in months.keys())
+        self.source = source
+        self.first = numbers[0]
+        index = np.full(numbers[-1] - self.first + 1, np.nan)
+        for key, value in months.items():
+            index[month_number(key) - self.first] = value
+        filled = np.maximum.accumulate(np.where(np.isnan(index), 0, np.arange(len(index))))
+        self.index = index[filled]
+        self.timestamps = np.array([month_start(i).timestamp() for i in range(self.first, numbers[-1] + 1)])
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def last(self):
+        return month_key(self.first + len(self.index) - 1)
+
+    def month(self, date):
+        """Index of the month of a datetime, None if it is outside the series"""
+        i = month_number(date) - self.first
+        return float(self.index[i]) if 0 <= i < len(self.index) else None
+
+    def at(self, date):
+        """Index at a datetime"""
+        i = month_number(date) - self.first
+        if i < 0:
+            return float(self.index[0])
+        if i >= len(self.index) - 1:
+            return float(self.index[-1])
+        fraction = (date.timestamp() - self.timestamps[i]) / (self.timestamps[i + 1] - self.timestamps[i])
+        return float(self.index[i] + fraction * (self.index[i + 1] - self.index[i]))
+
+    def at_timestamps(self, timestamps):
+        """Index at an array of timestamps"""
+        return np.interp(timestamps, self.timestamps, self.index)
+
+    def factor(self, start, end):
+        """Price change factor from datetime start to datetime end"""
+        return self.at(end) / self.at(start)
+
+    def months(self, start=None, end=None):
+        """Month start datetimes and values between datetimes start and end (inclusive, by month)"""
+        first = 0 if start is None else max(month_number(start) - self.first, 0)
+        last = len(self.index) if end is None else min(month_number(end) - self.first + 1, len(self.index))
+        return [month_start(self.first + i) for i in range(first, last)], self.index[first:last]
+
+
+class CpiStore():
+    """CPI values by (source, month), persisted in directory/cpi.json"""
+
+    def __init__(self, directory='cache'):
+        self.path = path.join(directory, 'cpi.json')
+        self.lock = threading.RLock()
+        self.sources = self.load()
+        self.cache = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as infile:
+                return json.load(infile)['sources']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save(self):
+        """Replace the file with the values in memory, callers hold the lock file"""
+        with self.lock:
+            with atomic_write(self.path) as outfile:
+                json.dump({'version': 1, 'sources': self.sources}, outfile)
+
+    def reload(self):
+        """Read the file again, other processes may have added months"""
+        with self.lock:
+            self.sources = self.load()
+            self.cache.clear()
+
+    def last(self, source):
+        """Last stored month of source as 'YYYYMM', None if nothing is stored"""
+        months = self.sources.get(source)
+        return max(months.keys()) if months else None
+
+    def add(self, source, months):
+        """Store {'YYYYMM': value} for source, returns the number of new or changed months"""
+        with self.lock, FileLock(self.path + '.lock'):
+            self.sources = self.load()  # Months added by other processes are kept
+            stored = self.sources.setdefault(source, {})
+            changed = {k: v for k, v in months.items() if stored.get(k) != v}
+            if changed:
+                stored.update(changed)
+                self.save()
+            self.cache.clear()
+            return len(changed)
+
+    def update(self, source, fetch, today=None):
+        """
+        Download the months after the last stored one up to the current month, fetch(first, last) returns
+        {'YYYYMM': value} for month numbers first to last. Returns the number of new months
+        """
+        today = today or datetime.datetime.today()
+        last = self.last(source)
+        first = month_number(FIRST_MONTH[source] if last is None else last) + (last is not None)
+        if first > month_number(today):
+            return 0
+        return self.add(source, fetch(first, month_number(today)))
+
+    def series(self, source):
+        """CpiSeries of source, built once per stored state"""
+        with self.lock:
+            if source not in self.cache:
+                self.cache[source] = CpiSeries(source, self.sources[source])
+            return self.cache[source]
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
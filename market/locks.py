@@ -0,0 +1,117 @@
+"""
+Cross process locks and atomic file replacement for the cache directory
+
+Several instances can share one cache directory, so every file is written to a temporary file and renamed over the
+old one (readers see either version, never a truncated file), and fetches of one series are serialized with a lock
+file so only one process downloads it.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STALE_LOCK = 600  # Seconds after which a lock file is considered left behind by a crashed process
+REPLACE_RETRIES = 20  # Windows refuses to replace a file another process has open or memory mapped
+
+
+class FileLock():
+    """
+    Lock file created with O_EXCL, shared by threads and processes
+
+    acquire polls until the file can be created, a lock file older than stale seconds is removed first. Raises
+    TimeoutError after timeout seconds. Not reentrant.
+    """
+
+    def __init__(self, file_path, timeout=300, stale=STALE_LOCK, poll=0.05):
+        self.path = file_path
+        self.timeout = timeout
+        self.stale = stale
+        self.poll = poll
+
+    def acquire(self):
+        start = time.monotonic()
+        while True:
+            try:
+                descriptor = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self.is_stale():
+                    self.break_lock()
+                    continue
+                if time.monotonic() - start > self.timeout:
+                    raise TimeoutError('Timed out waiting for {}'.format(self.path))
+                time.sleep(self.poll)
+                continue
+            with os.fdopen(descriptor, 'w') as lock_file:
+                lock_file.write('{} {}'.format(os.getpid(), threading.get_ident()))
+            return
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def is_stale(self):
+        try:
+            return time.time() - os.path.getmtime(self.path) > self.stale
+        except FileNotFoundError:
+            return False
+
+    def break_lock(self):
+        """
+        Remove a stale lock file
+
+        The file is first renamed to a tombstone only this waiter uses, so when several waiters find the same stale
+        file only one rename succeeds. If the renamed file turns out to be fresh (another waiter broke the stale one
+        and took the lock in between) it is linked back instead of removed.
+        """
+        tombstone = '{}.{}.{}.stale'.format(self.path, os.getpid(), threading.get_ident())
+        try:
+            os.rename(self.path, tombstone)
+        except FileNotFoundError:  # Broken by another waiter
+            return
+        try:
+            if time.time() - os.path.getmtime(tombstone) > self.stale:
+                print('Removing stale lock {}'.format(self.path))
+            else:
+                os.link(tombstone, self.path)
+        except FileExistsError:  # A new lock was taken meanwhile, it stays
+            pass
+        finally:
+            os.remove(tombstone)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def replace(source, destination):
+    """os.replace, retried while the destination is in use (Windows)"""
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            return os.replace(source, destination)
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+@contextmanager
+def atomic_write(file_path, mode='w'):
+    """
+    File object writing to a temporary file next to file_path, renamed over file_path when the block exits without
+    error and removed otherwise
+    """
+    temporary = '{}.{}.{}.tmp'.format(file_path, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary, mode) as outfile:
+            yield outfile
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        replace(temporary, file_path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
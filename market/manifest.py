@@ -0,0 +1,68 @@
+import datetime
+import json
+import threading
+from os import path
+
+from market.locks import FileLock, atomic_write
+
+
+class Manifest():
+    """
+    Index of the cache directory, one entry per series
+
+    Entries hold the last bar time, fetch time, source, payload checksum, schema version and the symbol the series was
+    downloaded with (when known), so freshness decisions for every series are made from this single file without
+    opening the payloads. Changes are merged into the file under a lock file, so processes sharing the cache directory
+    don't overwrite each other's entries.
+    """
+
+    def __init__(self, directory='cache'):
+        self.path = path.join(directory, 'manifest.json')
+        self.lock = threading.RLock()
+        self.series = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as infile:
+                return json.load(infile)['series']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def get(self, name):
+        with self.lock:
+            return self.series.get(name)
+
+    def reload(self, name=None):
+        """Read the file again (other processes may have changed it), returns the entry of name if given"""
+        with self.lock:
+            self.series = self.load()
+            return self.series.get(name)
+
+    def entries(self):
+        """Copy of {name: entry}"""
+        with self.lock:
+            return dict(self.series)
+
+    def update(self, name, last, source, checksum, schema, fetched=None, symbol=None):
+        """Record a series that was just written, fetched defaults to now"""
+        if fetched is None:
+            fetched = datetime.datetime.now().timestamp()
+        entry = {'last': last, 'fetched': int(fetched), 'source': source, 'checksum': checksum, 'schema': schema}
+        if symbol is not None:
+            entry['symbol'] = symbol
+        with self.lock, FileLock(self.path + '.lock'):
+            self.series = self.load()
+            self.series[name] = entry
+            self.save()
+
+    def remove(self, name):
+        with self.lock, FileLock(self.path + '.lock'):
+            self.series = self.load()
+            if self.series.pop(name, None) is not None:
+                self.save()
+
+    def save(self):
+        """Replace the file with the entries in memory, callers hold the lock file"""
+        with self.lock:
+            with atomic_write(self.path) as outfile:
+                json.dump({'version': 1, 'series': self.series}, outfile)
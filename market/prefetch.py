@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher():
+    """
+    Runs downloads on a bounded worker pool with a concurrency limit per host
+
+    Use as a context manager, submit returns a concurrent.futures.Future with the function result
+    """
+
+    def __init__(self, workers=8, host_limits=None, default_limit=4):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.host_limits = host_limits or {}
+        self.default_limit = default_limit
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, host, function, *args):
+        """Run function(*args) once a worker and a slot for host are available"""
+        semaphore = self.semaphore(host)
+
+        def task():
+            with semaphore:
+                return function(*args)
+
+        return self.executor.submit(task)
+
+    def semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores.keys():
+                self.semaphores[host] = threading.BoundedSemaphore(self.host_limits.get(host, self.default_limit))
+            return self.semaphores[host]
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,96 @@
+"""
+Batched live quotes
+
+Every symbol asked for in one call is fetched with as few v7 quote requests as possible (BATCH symbols each) and kept
+for TTL seconds, so valuing a whole portfolio costs a handful of requests per refresh. Symbols the source has no
+price for are remembered as well, so they aren't asked for again before the TTL either. Subscribers get only the
+quotes whose price changed since their last poll.
+"""
+import datetime
+import itertools
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote, unquote
+
+from market import transport
+
+QUOTE_URL = 'https://query2.finance.yahoo.com/v7/finance/quote?region=US&lang=en&symbols={}'
+BATCH = 50
+TTL = 60
+
+Quote = namedtuple('Quote', ['price', 'time', 'currency'])
+
+
+class QuoteService():
+    """Live quotes by Yahoo symbol with a TTL cache and delta subscriptions"""
+
+    def __init__(self, get_json=None, ttl=TTL, batch=BATCH):
+        self.get_json = get_json or transport.client.get_json
+        self.ttl = ttl
+        self.batch = batch
+        self.quotes = {}  # symbol -> (Quote or None without a price, monotonic fetch time)
+        self.subscriptions = {}  # id -> [symbols, callback, {symbol: last price pushed}]
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def get(self, symbols):
+        """{symbol: Quote} for an iterable of Yahoo symbols, only missing or expired quotes are downloaded"""
+        symbols = [unquote(i) for i in symbols]
+        now = time.monotonic()
+        with self.lock:
+            expired = sorted({i for i in symbols if i not in self.quotes or now - self.quotes[i][1] > self.ttl})
+        for start in range(0, len(expired), self.batch):
+            self.fetch(expired[start:start + self.batch])
+
+        with self.lock:
+            return {i: self.quotes[i][0] for i in symbols if self.quotes.get(i, (None,))[0] is not None}
+
+    def quote(self, symbol):
+        """Quote of a single symbol, raises KeyError if the source doesn't know it"""
+        return self.get([symbol])[unquote(symbol)]
+
+    def fetch(self, symbols):
+        answer = self.get_json(QUOTE_URL.format(','.join(quote(i, safe='=.-') for i in symbols)))
+        now = time.monotonic()
+        with self.lock:
+            self.quotes.update({i: (None, now) for i in symbols})  # Replaced below by the quotes received
+            for result in answer['quoteResponse']['result']:
+                if 'regularMarketPrice' not in result:
+                    continue
+                self.quotes[result['symbol']] = (Quote(result['regularMarketPrice'], datetime.datetime.fromtimestamp(
+                    result['regularMarketTime']), result.get('currency')), now)
+
+    def subscribe(self, symbols, callback=None):
+        """Register symbols for poll, callback(changes) is called with the changed quotes, returns the subscription id"""
+        with self.lock:
+            key = next(self.ids)
+            self.subscriptions[key] = [{unquote(i) for i in symbols}, callback, {}]
+            return key
+
+    def unsubscribe(self, key):
+        with self.lock:
+            self.subscriptions.pop(key, None)
+
+    def poll(self):
+        """
+        Refresh the quotes of every subscribed symbol in one batched round and push the deltas
+
+        Each subscriber receives {symbol: Quote} for the symbols whose price changed since its previous poll (all of
+        them the first time). Returns {subscription id: changes}
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions.items())
+        quotes = self.get(set().union(*[i[1][0] for i in subscriptions]) if subscriptions else [])
+
+        pushed = {}
+        for key, (symbols, callback, last) in subscriptions:
+            changes = {i: quotes[i] for i in symbols if i in quotes and last.get(i) != quotes[i].price}
+            last.update({i: value.price for i, value in changes.items()})
+            pushed[key] = changes
+            if callback is not None and changes:
+                callback(changes)
+        return pushed
+
+
+service = QuoteService()
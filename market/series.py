@@ -0,0 +1,57 @@
+import datetime
+
+import numpy as np
+
+
+class PriceSeries():
+    """
+    Daily price history of one symbol
+
+    Built once per symbol by the data layer and shared by every consumer. Timestamps and close are contiguous
+    int64/float64 arrays (read-only views of the cache file where possible), dividends and splits are sorted event
+    arrays. Volume is only converted when asked for, so loading a series doesn't touch its pages. Columns come
+    normalized from the store (see market.store.normalize_columns).
+    """
+    __slots__ = ('symbol', 'currency', 'gmtoffset', 'timestamp', 'close', '_volume', 'div_date', 'div_amount',
+                 'split_date', 'split_ratio')
+
+    def __init__(self, symbol, currency, timestamp, close, volume=None, div_date=(), div_amount=(), split_date=(),
+                 split_ratio=(), gmtoffset=0):
+        self.symbol = symbol
+        self.currency = currency
+        self.gmtoffset = gmtoffset
+        self.timestamp = np.ascontiguousarray(timestamp, dtype=np.int64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+        self._volume = volume
+        self.div_date = np.ascontiguousarray(div_date, dtype=np.int64)
+        self.div_amount = np.ascontiguousarray(div_amount, dtype=np.float64)
+        self.split_date = np.ascontiguousarray(split_date, dtype=np.int64)
+        self.split_ratio = np.ascontiguousarray(split_ratio, dtype=np.float64)
+
+    @classmethod
+    def from_columns(cls, symbol, columns, meta):
+        """Series from market.store columns and meta data"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.divide(columns['split_numerator'], columns['split_denominator'], dtype=np.float64)
+        return cls(symbol, meta.get('currency'), columns['timestamp'], columns['close'], columns['volume'],
+                   columns['div_date'], columns['div_amount'], columns['split_date'], ratio, meta.get('gmtoffset', 0))
+
+    @property
+    def volume(self):
+        if self._volume is None:
+            return np.zeros(len(self.timestamp), dtype=np.int64)
+        return np.ascontiguousarray(np.nan_to_num(self._volume), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __repr__(self):
+        return '<PriceSeries {} {} bars>'.format(self.symbol, len(self))
+
+    def dividends(self):
+        """Dividend amounts by date"""
+        return {datetime.datetime.fromtimestamp(d): a for d, a in zip(self.div_date.tolist(), self.div_amount.tolist())}
+
+    def splits(self):
+        """Split ratios (numerator / denominator) by date"""
+        return {datetime.datetime.fromtimestamp(d): r for d, r in zip(self.split_date.tolist(), self.split_ratio.tolist())}
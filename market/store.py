@@ -0,0 +1,243 @@
+"""
+Columnar binary cache for market data series
+
+File layout:
+    8 bytes   magic (b'PYIVCOL1')
+    4 bytes   little endian header length
+    header    utf8 JSON with the schema version, the series meta data and the position of every column
+    columns   typed arrays, each one aligned to 8 bytes
+
+Columns are read through a memory map, so only the pages actually used are loaded from disk. Series are normalized
+(see normalize_columns) before being written, readers can use the arrays as they are.
+"""
+import hashlib
+import json
+import struct
+from os import listdir, path, remove
+
+import numpy as np
+
+from market.locks import atomic_write
+
+MAGIC = b'PYIVCOL1'
+SCHEMA = 2  # 2: columns are normalized
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+COLUMN_TYPES = {'timestamp': '<i8', 'open': '<f8', 'high': '<f8', 'low': '<f8', 'close': '<f8', 'volume': '<f8',
+                'div_date': '<i8', 'div_amount': '<f8',
+                'split_date': '<i8', 'split_numerator': '<f8', 'split_denominator': '<f8'}
+
+
+def write_series(file_path, columns, meta):
+    """
+    Normalize a dict of arrays (see COLUMN_TYPES) and write it with a meta data dict to file_path, returns the header
+    and checksum
+    """
+    columns = normalize_columns(columns, meta.get('gmtoffset', 0))
+    arrays = {name: np.ascontiguousarray(columns.get(name, []), dtype=dtype) for name, dtype in COLUMN_TYPES.items()}
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = [COLUMN_TYPES[name], offset, len(array)]
+        offset += _aligned(array.nbytes)
+
+    last = int(arrays['timestamp'][-1]) if len(arrays['timestamp']) else None
+    header = json.dumps({'schema': SCHEMA, 'last': last, 'meta': meta, 'columns': layout}).encode('utf8')
+    start = _aligned(len(MAGIC) + 4 + len(header))
+
+    checksum = hashlib.sha1()
+    with atomic_write(file_path, 'wb') as outfile:
+        for chunk in _chunks(header, start, arrays):
+            checksum.update(chunk)
+            outfile.write(chunk)
+
+    return {'schema': SCHEMA, 'last': last, 'meta': meta}, checksum.hexdigest()
+
+
+def _chunks(header, start, arrays):
+    yield MAGIC + struct.pack('<I', len(header)) + header
+    yield b'\0' * (start - len(MAGIC) - 4 - len(header))
+    for array in arrays.values():
+        yield array.tobytes()
+        yield b'\0' * (_aligned(array.nbytes) - array.nbytes)
+
+
+def file_checksum(file_path):
+    """Checksum of a file as computed by write_series"""
+    checksum = hashlib.sha1()
+    with open(file_path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def read_header(file_path):
+    """Header only (schema, last timestamp, meta and column layout), the columns are not touched"""
+    with open(file_path, 'rb') as infile:
+        start = infile.read(len(MAGIC) + 4)
+        if len(start) < len(MAGIC) + 4 or start[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a series file'.format(file_path))
+        size = struct.unpack('<I', start[len(MAGIC):])[0]
+        header = json.loads(infile.read(size).decode('utf8'))
+    header['start'] = _aligned(len(MAGIC) + 4 + size)
+    return header
+
+
+def read_series(file_path):
+    """Header and a dict of read-only column views over a memory map of file_path"""
+    header = read_header(file_path)
+    data = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+    columns = {}
+    for name, (dtype, offset, count) in header['columns'].items():
+        start = header['start'] + offset
+        size = count * np.dtype(dtype).itemsize
+        columns[name] = data[start:start + size].view(dtype)
+    return header, columns
+
+
+def normalize_columns(columns, gmtoffset=0, leading='drop'):
+    """
+    Clean columns once at ingest so consumers don't have to
+
+    Bars are sorted and bucketed by exchange day (gmtoffset is the exchange offset from UTC in seconds), missing prices
+    repeat the previous bar and only the last bar of each day is kept. Bars before the first close are dropped
+    (leading='drop') or take the first close (leading='backfill'), missing volume is 0. Dividends and splits are sorted
+    and deduplicated by day the same way.
+    """
+    timestamp = np.asarray(columns.get('timestamp', []), dtype=np.int64)
+    order = np.argsort(timestamp, kind='stable')
+    normalized = {'timestamp': timestamp[order]}
+    for name in PRICE_COLUMNS:
+        values = np.asarray(columns.get(name, np.full(len(timestamp), np.nan)), dtype=np.float64)[order]
+        if name == 'volume':
+            normalized[name] = np.nan_to_num(values)
+            continue
+        valid = ~np.isnan(values)
+        filled = np.maximum.accumulate(np.where(valid, np.arange(len(values)), -1))
+        if leading == 'backfill' and valid.any():
+            filled[filled < 0] = valid.argmax()
+        normalized[name] = np.where(filled >= 0, values[np.maximum(filled, 0)], np.nan)
+
+    last = _last_per_day(normalized['timestamp'], gmtoffset)
+    normalized = {name: values[last] for name, values in normalized.items()}
+    if leading == 'drop':
+        priced = ~np.isnan(normalized['close'])
+        first = priced.argmax() if priced.any() else len(priced)
+        normalized = {name: values[first:] for name, values in normalized.items()}
+
+    for date, values in (('div_date', ['div_amount']), ('split_date', ['split_numerator', 'split_denominator'])):
+        dates = np.asarray(columns.get(date, []), dtype=np.int64)
+        order = np.argsort(dates, kind='stable')
+        last = order[_last_per_day(dates[order], gmtoffset)]
+        normalized[date] = dates[last]
+        for name in values:
+            normalized[name] = np.asarray(columns.get(name, []), dtype=np.float64)[last]
+
+    return normalized
+
+
+def chart_to_columns(chart):
+    """Columns and meta data from a Yahoo Finance v8 chart response, missing values become NaN"""
+    result = chart['chart']['result'][0]
+    timestamps = result.get('timestamp', [])
+    quote = result.get('indicators', {}).get('quote', [{}])[0]
+
+    columns = {'timestamp': np.array(timestamps, dtype=np.int64)}
+    for name in PRICE_COLUMNS:
+        values = quote.get(name, [None] * len(timestamps))
+        columns[name] = np.array([np.nan if i is None else i for i in values], dtype=np.float64)
+
+    events = result.get('events', {})
+    dividends = sorted(events.get('dividends', {}).values(), key=lambda i: i['date'])
+    columns['div_date'] = [i['date'] for i in dividends]
+    columns['div_amount'] = [i['amount'] for i in dividends]
+    splits = sorted(events.get('splits', {}).values(), key=lambda i: i['date'])
+    columns['split_date'] = [i['date'] for i in splits]
+    columns['split_numerator'] = [i['numerator'] for i in splits]
+    columns['split_denominator'] = [i['denominator'] for i in splits]
+
+    return columns, result.get('meta', {})
+
+
+def merge_columns(columns, update, gmtoffset=0):
+    """
+    Merge the columns of an incremental download into cached columns
+
+    Bars are bucketed by exchange day (gmtoffset is the exchange offset from UTC in seconds), the update replaces every
+    cached bar from its first day on and only the last bar of each day is kept. Dividends and splits are merged by day
+    with the update taking precedence. Returns None when the update has a split the cache does not know about.
+    """
+    known_splits = set(_days(columns['split_date'], gmtoffset).tolist())
+    if any(day not in known_splits for day in _days(update['split_date'], gmtoffset).tolist()):
+        return None
+
+    update_days = _days(update['timestamp'], gmtoffset)
+    if len(update_days):
+        keep = _days(columns['timestamp'], gmtoffset) < update_days[0]
+    else:
+        keep = np.ones(len(columns['timestamp']), dtype=bool)
+
+    merged = {name: np.concatenate((columns[name][keep], update[name])) for name in ['timestamp'] + PRICE_COLUMNS}
+    last = _last_per_day(merged['timestamp'], gmtoffset)
+    merged = {name: values[last] for name, values in merged.items()}
+
+    for date, values in (('div_date', ['div_amount']), ('split_date', ['split_numerator', 'split_denominator'])):
+        dates = np.concatenate((columns[date], np.asarray(update[date], dtype=np.int64)))
+        events = {name: np.concatenate((columns[name], np.asarray(update[name], dtype=np.float64))) for name in values}
+        days = _days(dates, gmtoffset)
+        # Last occurrence of each day wins, the update comes after the cached events
+        order = np.lexsort((np.arange(len(days)), days))
+        days, dates = days[order], dates[order]
+        last = np.append(days[1:] != days[:-1], True) if len(days) else np.zeros(0, dtype=bool)
+        merged[date] = dates[last]
+        for name in values:
+            merged[name] = events[name][order][last]
+
+    return merged
+
+
+def upgrade(file_path):
+    """Rewrite a series written with an older schema in the current one, returns write_series result"""
+    header, columns = read_series(file_path)
+    columns = {name: np.array(values) for name, values in columns.items()}  # Copies, so the memory map can be released
+    return write_series(file_path, columns, header['meta'])
+
+
+def migrate(json_path, file_path):
+    """Convert a JSON chart cache file to the columnar format and remove the JSON file, returns write_series result"""
+    with open(json_path, 'r') as infile:
+        chart = json.load(infile)
+    written = write_series(file_path, *chart_to_columns(chart))
+    remove(json_path)
+    return written
+
+
+def migrate_cache(directory='cache'):
+    """One time conversion of every JSON chart file in directory, files that are not charts are left untouched"""
+    converted = []
+    for name in listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        json_path = path.join(directory, name)
+        try:
+            migrate(json_path, json_path[:-len('.json')] + '.bin')
+            converted.append(name[:-len('.json')])
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+    return converted
+
+
+def _days(timestamps, gmtoffset=0):
+    return (np.asarray(timestamps, dtype=np.int64) + int(gmtoffset)) // 86400
+
+
+def _last_per_day(timestamps, gmtoffset=0):
+    """Mask of the last of each run of sorted timestamps falling on the same exchange day"""
+    days = _days(timestamps, gmtoffset)
+    return np.append(days[1:] != days[:-1], True) if len(days) else np.zeros(0, dtype=bool)
+
+
+def _aligned(size):
+    return (size + 7) // 8 * 8
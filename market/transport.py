@@ -0,0 +1,275 @@
+"""
+Shared HTTP transport for every data source
+
+Keeps alive one small connection pool per host, asks for gzip, applies timeouts, follows redirects, retries 429/5xx
+answers and connection errors with exponential backoff and limits the request rate per host with a token bucket.
+Request counts and latencies are kept per host, see HttpClient.stats.
+
+Responses can be recorded to and replayed from a fixture directory (mode='record' / 'offline'), so everything above
+the transport runs without network. The mode of the shared client comes from the PYINVEST_NETWORK environment variable
+(live, record or offline) and the directory from PYINVEST_FIXTURES (default 'fixtures').
+"""
+import datetime
+import gzip
+import hashlib
+import http.client
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from os import environ, makedirs, path
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from market.locks import atomic_write
+
+MODES = ('live', 'record', 'offline')
+VOLATILE_PARAMS = {'period2'}  # Query parameters left out of fixture keys
+
+
+class HttpError(Exception):
+    def __init__(self, url, status, reason=''):
+        super(HttpError, self).__init__('{} {} for {}'.format(status, reason, url))
+        self.url = url
+        self.status = status
+
+
+class FixtureMissing(Exception):
+    """Raised in offline mode for a request that has no recorded response"""
+
+    def __init__(self, method, url):
+        super(FixtureMissing, self).__init__('No recorded response for {} {}'.format(method, url))
+        self.url = url
+
+
+def fixture_key(url):
+    """
+    url without the parts that follow the current date, so a recorded response keeps matching on later runs: the end
+    time of chart requests (period2) and every month after the first in an IBGE period list
+    """
+    parts = urlsplit(url)
+    query = '&'.join(i for i in parts.query.split('&') if i.split('=')[0] not in VOLATILE_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc, re.sub(r'/periodos/(\d+)[^/]*', r'/periodos/\1', parts.path), query,
+                       parts.fragment))
+
+
+class TokenBucket():
+    """rate tokens per second with at most capacity stored, acquire blocks until a token is available"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HttpClient():
+    retry_status = {429, 500, 502, 503, 504}
+    redirect_status = {301, 302, 303, 307, 308}
+    max_redirects = 5
+    headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+
+    def __init__(self, timeout=20, retries=4, backoff=0.5, rate=5, burst=10, pool_size=4, host_rates=None, mode='live',
+                 fixtures='fixtures'):
+        if mode not in MODES:
+            raise ValueError('Unknown network mode {}, expected one of {}'.format(mode, MODES))
+        self.mode = mode
+        self.fixtures = fixtures
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate = rate
+        self.burst = burst
+        self.pool_size = pool_size
+        self.host_rates = host_rates or {}  # host -> (rate, burst)
+        self.pools = {}
+        self.buckets = {}
+        self._stats = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers=headers)
+
+    def get_text(self, url, headers=None, encoding='utf8'):
+        return self.get(url, headers).decode(encoding)
+
+    def get_json(self, url, headers=None):
+        return json.loads(self.get_text(url, headers))
+
+    def post_json(self, url, payload, headers=None):
+        headers = dict(headers or {}, **{'Content-type': 'application/json'})
+        return json.loads(self.request('POST', url, json.dumps(payload).encode('utf8'), headers).decode('utf8'))
+
+    @property
+    def offline(self):
+        return self.mode == 'offline'
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Response body of a request, retried on 429/5xx and connection errors, raises HttpError otherwise
+
+        Redirects are followed up to max_redirects hops, a 303 (or a 301/302 answering a POST) continues as a GET.
+        Offline the recorded response is returned without touching the network, FixtureMissing is raised if there is
+        none. When recording every successful response is written to the fixture directory
+        """
+        if self.offline:
+            return self.replay(method, url, body)
+
+        target, target_method, target_body = url, method, body
+        headers = dict(self.headers, **(headers or {}))
+        for hop in range(self.max_redirects + 1):
+            response, data = self.send(target_method, target, target_body, headers)
+            location = response.getheader('Location')
+            if response.status in self.redirect_status and location:
+                target = urljoin(target, location)
+                if response.status == 303 or response.status in (301, 302) and target_method == 'POST':
+                    target_method, target_body = 'GET', None
+                    headers.pop('Content-type', None)
+                continue
+            if response.status >= 400:
+                raise HttpError(target, response.status, response.reason)
+
+            data = self.decode(data, response.getheader('Content-Encoding', ''))
+            if self.mode == 'record':
+                self.save_fixture(method, url, body, data)
+            return data
+
+        raise HttpError(url, response.status, 'more than {} redirects'.format(self.max_redirects))
+
+    def send(self, method, url, body, headers):
+        """One request on a pooled connection with retries, returns the response and its raw body"""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = parts.path + ('?' + parts.query if parts.query else '') or '/'
+
+        for attempt in range(self.retries + 1):
+            self.bucket(parts.netloc).acquire()
+            connection = self.connection(key)
+            start = time.monotonic()
+            try:
+                connection.request(method, target, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                self.record(parts.netloc, time.monotonic() - start, error=True)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.delay(attempt))
+                continue
+
+            self.record(parts.netloc, time.monotonic() - start, len(data), error=response.status >= 400)
+            if response.getheader('Connection', '').lower() == 'close' or response.will_close:
+                connection.close()
+            else:
+                self.release(key, connection)
+
+            if response.status in self.retry_status and attempt < self.retries:
+                time.sleep(self.delay(attempt, response.getheader('Retry-After')))
+                continue
+            return response, data
+
+    def fixture_path(self, method, url, body=None):
+        """Fixture file of a request without extension, <fixtures>/<host>/<sha1 of method, fixture_key(url) and body>"""
+        digest = hashlib.sha1(b'\n'.join((method.encode('utf8'), fixture_key(url).encode('utf8'), body or b''))).hexdigest()
+        return path.join(self.fixtures, urlsplit(url).netloc, digest)
+
+    def replay(self, method, url, body=None):
+        try:
+            with open(self.fixture_path(method, url, body) + '.body', 'rb') as infile:
+                return infile.read()
+        except FileNotFoundError:
+            raise FixtureMissing(method, url)
+
+    def save_fixture(self, method, url, body, data):
+        """Response body in <fixture>.body and the request in <fixture>.json, for people reading the fixtures"""
+        file_path = self.fixture_path(method, url, body)
+        makedirs(path.dirname(file_path), exist_ok=True)
+        with atomic_write(file_path + '.body', 'wb') as outfile:
+            outfile.write(data)
+        with atomic_write(file_path + '.json') as outfile:
+            json.dump({'method': method, 'url': url, 'body': body.decode('utf8') if body else None,
+                       'recorded': datetime.datetime.now().isoformat(timespec='seconds')}, outfile)
+
+    def delay(self, attempt, retry_after=None):
+        """Exponential backoff with jitter, a numeric Retry-After header takes precedence"""
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt * (1 + random.random() / 2)
+
+    @staticmethod
+    def decode(data, encoding):
+        if encoding == 'gzip':
+            return gzip.decompress(data)
+        if encoding == 'deflate':
+            return zlib.decompress(data)
+        return data
+
+    def connection(self, key):
+        with self.lock:
+            idle = self.pools.setdefault(key, deque())
+            if idle:
+                return idle.pop()
+        scheme, netloc = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def release(self, key, connection):
+        with self.lock:
+            idle = self.pools.setdefault(key, deque())
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets.keys():
+                self.buckets[host] = TokenBucket(*self.host_rates.get(host, (self.rate, self.burst)))
+            return self.buckets[host]
+
+    def record(self, host, latency, size=0, error=False):
+        with self.lock:
+            stats = self._stats.setdefault(host, {'requests': 0, 'errors': 0, 'bytes': 0, 'time': 0.0,
+                                                  'latencies': deque(maxlen=1000)})
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['bytes'] += size
+            stats['time'] += latency
+            stats['latencies'].append(latency)
+
+    def stats(self):
+        """Per host request count, errors, bytes, total time, mean and maximum latency of the last requests"""
+        with self.lock:
+            result = {}
+            for host, stats in self._stats.items():
+                latencies = list(stats['latencies'])
+                result[host] = {'requests': stats['requests'], 'errors': stats['errors'], 'bytes': stats['bytes'],
+                                'time': stats['time'], 'mean': sum(latencies) / len(latencies) if latencies else 0,
+                                'max': max(latencies) if latencies else 0}
+            return result
+
+    def close(self):
+        with self.lock:
+            for idle in self.pools.values():
+                while idle:
+                    idle.pop().close()
+
+
+client = HttpClient(mode=environ.get('PYINVEST_NETWORK', 'live'), fixtures=environ.get('PYINVEST_FIXTURES', 'fixtures'))
@@ -106,8 +106,9 @@ class PlotWidget(pg.PlotWidget):
             a.append(item)
             i += 1
 
+        if name not in self.combo_plots:  # Plots are replaced when transactions are reloaded
+            self.combo.addItem(name)
         self.combo_plots[name] = a
-        self.combo.addItem(name)
 
     def select_plot(self, a):
         self.plot_title.setText(a)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import util
+
+DAY = 86400
+START = 1577880000  # 2020-01-01 12:00 UTC
+
+
+def chart(days, close):
+    return {'chart': {'result': [{'meta': {'currency': 'USD', 'gmtoffset': 0},
+                                  'timestamp': [START + i * DAY for i in days],
+                                  'indicators': {'quote': [{'close': close, 'volume': [1] * len(days)}]}}]}}
+
+
+class CachedHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.mkdir('cache')
+        util.get_manifest.cache_clear()
+        self.urls = []
+        for patch in (mock.patch.object(util, 'get_url', self.get_url),
+                      mock.patch.object(util, 'chart_is_stale', lambda last: True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        util.get_manifest.cache_clear()
+        self.directory.cleanup()
+
+    def get_url(self, url):
+        self.urls.append(url)
+        if 'range=50y' in url:
+            return chart(range(5), [1.0, 2.0, 3.0, 4.0, 5.0])
+        return chart(range(3, 7), [40.0, 50.0, 60.0, 70.0])
+
+    def make_stale(self):
+        manifest = util.get_manifest()
+        entry = manifest.get('ABC')
+        manifest.update('ABC', entry['last'], entry['source'], entry['checksum'], entry['schema'], 0, 'ABC')
+
+    def test_download_and_update(self):
+        columns, meta = util.cached_history('ABC', 'ABC')
+        self.assertEqual(columns['close'].tolist(), [1.0, 2.0, 3.0, 4.0, 5.0])
+        del columns
+
+        self.make_stale()
+        columns, meta = util.cached_history('ABC', 'ABC')
+        self.assertEqual(columns['close'].tolist(), [1.0, 2.0, 3.0, 40.0, 50.0, 60.0, 70.0])
+        self.assertEqual(len(self.urls), 2)
+        self.assertIn('period1', self.urls[1])
+
+    def test_file_in_use(self):
+        # On Windows a file memory mapped by another process can't be replaced
+        util.cached_history('ABC', 'ABC')
+        self.make_stale()
+        with mock.patch.object(util, 'write_series', side_effect=PermissionError('in use')):
+            columns, meta = util.cached_history('ABC', 'ABC')
+        self.assertEqual(columns['close'].tolist(), [1.0, 2.0, 3.0, 40.0, 50.0, 60.0, 70.0])
+        self.assertEqual(len(self.urls), 2)  # No full download after the failed write
+        self.assertEqual(util.get_manifest().get('ABC')['fetched'], 0)  # The cache is still stale
+
+
+if __name__ == '__main__':
+    unittest.main()
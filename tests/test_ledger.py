@@ -0,0 +1,146 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from financial import ledger
+from financial.ledger import TransactionFile, TransactionSources, merge, read_transactions
+
+HEADER = 'Date\tType\tSymbol\tOrder\tQuantity\tPrice\tTotal\n'
+
+
+def row(day, symbol='AAA', quantity=1, price=10.0):
+    return '{:02d}/01/2020\tBR\t{}\tBuy\t{}\t{}\t{}\n'.format(day, symbol, quantity, price, quantity * price)
+
+
+class LedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def write(self, file_path, *rows, mode='w', header=True):
+        with open(file_path, mode) as outfile:
+            outfile.write((HEADER if header else '') + ''.join(rows))
+
+    def append(self, file_path, *rows):
+        self.write(file_path, *rows, mode='a', header=False)
+        stat = os.stat(file_path)  # A new mtime even on file systems with coarse timestamps
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+class ReadTest(LedgerTest):
+
+    def test_descending_file_keeps_same_day_order_reversed(self):
+        self.write('t.txt', row(3, 'CCC'), row(2, 'BBB'), row(2, 'AAA'), row(1, 'AAA'))
+        transactions = read_transactions('t.txt', chunksize=2)
+        self.assertEqual(list(transactions['Symbol']), ['AAA', 'AAA', 'BBB', 'CCC'])
+        self.assertTrue(transactions['Date'].is_monotonic_increasing)
+
+    def test_quantity_types(self):
+        self.write('t.txt', row(1), row(2, quantity=3))
+        self.assertEqual(read_transactions('t.txt')['Quantity'].dtype, np.int64)
+        self.write('t.txt', row(1), row(2, quantity=1.5))
+        self.assertEqual(read_transactions('t.txt')['Quantity'].dtype, np.float64)
+
+
+class MergeTest(LedgerTest):
+
+    def test_duplicates_across_files(self):
+        # The same trade twice in one file is two trades, copies of them in another file are the same two trades
+        self.write('a.txt', row(1), row(2, 'BBB'), row(2, 'BBB'), row(4))
+        self.write('b.txt', row(2, 'BBB'), row(2, 'BBB'), row(2, 'BBB'), row(3, 'CCC'))
+        merged = merge([read_transactions('a.txt'), read_transactions('b.txt')])
+        self.assertEqual(list(merged['Symbol']), ['AAA', 'BBB', 'BBB', 'BBB', 'CCC', 'AAA'])
+        self.assertTrue(merged['Date'].is_monotonic_increasing)
+
+    def test_sources_append(self):
+        self.write('a.txt', row(1), row(3))
+        self.write('b.csv', (HEADER + row(2, 'BBB')).replace('\t', ';'), header=False)  # Separator by extension
+        sources = TransactionSources([{'files': '*.txt'}, {'files': 'b.csv'}], cache='cache')
+        transactions, appended = sources.read()
+        self.assertIsNone(appended)
+        self.assertEqual(list(transactions['Symbol']), ['AAA', 'BBB', 'AAA'])
+
+        self.append('a.txt', row(5, 'DDD'))
+        transactions, appended = sources.read()
+        self.assertEqual(list(appended['Symbol']), ['DDD'])
+        self.assertEqual(len(transactions), 4)
+
+
+class TransactionFileTest(LedgerTest):
+
+    def test_appended_rows_only(self):
+        self.write('t.txt', row(1), row(2))
+        transactions = TransactionFile('t.txt')
+        self.assertIsNone(transactions.read()[1])
+        self.assertEqual(len(transactions.read()[1]), 0)
+
+        self.append('t.txt', row(3, 'BBB'), row(4, 'CCC'))
+        with mock.patch.object(ledger, 'read_transactions', wraps=read_transactions) as reader:
+            table, appended = transactions.read()
+        self.assertEqual(list(appended['Symbol']), ['BBB', 'CCC'])
+        self.assertEqual(list(appended.index), [2, 3])
+        self.assertEqual(reader.call_args[0][0].getvalue(), HEADER.encode() + (row(3, 'BBB') + row(4, 'CCC')).encode())
+        pd.testing.assert_frame_equal(table, read_transactions('t.txt'))
+
+    def test_missing_final_newline(self):
+        self.write('t.txt', row(1), row(2).rstrip('\n'))
+        transactions = TransactionFile('t.txt')
+        transactions.read()
+        self.append('t.txt', '\n' + row(3, 'BBB'))
+        table, appended = transactions.read()
+        self.assertEqual(list(appended['Symbol']), ['BBB'])
+        pd.testing.assert_frame_equal(table, read_transactions('t.txt'))
+
+    def test_rewritten_row_forces_full_read(self):
+        self.write('t.txt', row(1), row(2))
+        transactions = TransactionFile('t.txt')
+        transactions.read()
+        self.write('t.txt', row(1, quantity=5), row(2), row(3))
+        table, appended = transactions.read()
+        self.assertIsNone(appended)
+        self.assertEqual(list(table['Quantity']), [5, 1, 1])
+
+    def test_older_row_forces_full_read(self):
+        self.write('t.txt', row(2), row(3))
+        transactions = TransactionFile('t.txt')
+        transactions.read()
+        self.append('t.txt', row(1, 'OLD'))
+        table, appended = transactions.read()
+        self.assertIsNone(appended)
+        self.assertEqual(list(table['Symbol']), ['OLD', 'AAA', 'AAA'])
+
+    def test_restart_uses_stored_table(self):
+        self.write('t.txt', row(1), row(2))
+        TransactionFile('t.txt', cache='cache/t.pkl').read()
+        with mock.patch.object(ledger, 'read_transactions', side_effect=AssertionError('parsed again')):
+            table, appended = TransactionFile('t.txt', cache='cache/t.pkl').read()
+        self.assertEqual(len(table), 2)
+
+    def test_touched_file_is_hashed_once(self):
+        self.write('t.txt', row(1), row(2))
+        TransactionFile('t.txt', cache='cache/t.pkl').read()
+        stored = os.stat('cache/t.pkl').st_mtime_ns
+        time.sleep(0.01)
+        self.append('t.txt')  # Only touched
+
+        with mock.patch.object(ledger, '_digest', wraps=ledger._digest) as digest:
+            for restart in range(3):
+                table, appended = TransactionFile('t.txt', cache='cache/t.pkl').read()
+                self.assertEqual(len(table), 2)
+        self.assertEqual(digest.call_count, 1)
+        self.assertEqual(os.stat('cache/t.pkl').st_mtime_ns, stored)  # The table itself wasn't written again
+
+
+if __name__ == '__main__':
+    unittest.main()
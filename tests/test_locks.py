@@ -0,0 +1,60 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from market.locks import FileLock
+
+
+class FileLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'series.lock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_stale(self):
+        with open(self.path, 'w') as lock_file:
+            lock_file.write('0 0')
+        old = time.time() - 1000
+        os.utime(self.path, (old, old))
+
+    def test_stale_lock_is_broken(self):
+        self.make_stale()
+        with FileLock(self.path, timeout=1, stale=10):
+            self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_fresh_lock_is_not_broken(self):
+        # A waiter that saw the old stale file breaks the lock after another waiter already took a new one
+        with FileLock(self.path, stale=10):
+            FileLock(self.path, stale=10).break_lock()
+            self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_waiters_share_stale_lock(self):
+        self.make_stale()
+        holders = []
+        inside = []
+
+        def wait():
+            with FileLock(self.path, timeout=10, stale=10, poll=0.001):
+                inside.append(1)
+                holders.append(len(inside))
+                time.sleep(0.01)
+                inside.pop()
+
+        threads = [threading.Thread(target=wait) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(holders, [1] * 8)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
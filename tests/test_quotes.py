@@ -0,0 +1,57 @@
+import unittest
+from urllib.parse import unquote
+
+from market.quotes import QuoteService
+
+
+class QuoteServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prices = {'AAA': 1.0, 'BBB': 2.0, '^BVSP': 3.0, 'USDBRL=X': 5.0}
+        self.requests = []
+        self.service = QuoteService(self.get_json, ttl=60, batch=2)
+
+    def get_json(self, url):
+        symbols = unquote(url.split('symbols=')[1]).split(',')
+        self.requests.append(symbols)
+        return {'quoteResponse': {'result': [
+            {'symbol': i, 'regularMarketPrice': self.prices[i], 'regularMarketTime': 0, 'currency': 'USD'}
+            for i in symbols if i in self.prices]}}
+
+    def test_batches_and_caches(self):
+        quotes = self.service.get(['AAA', 'BBB', '%5EBVSP', 'USDBRL=X'])
+        self.assertEqual({i: quote.price for i, quote in quotes.items()},
+                         {'AAA': 1.0, 'BBB': 2.0, '^BVSP': 3.0, 'USDBRL=X': 5.0})
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.service.quote('AAA').price, 1.0)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_expired_quotes_are_fetched_again(self):
+        self.service.get(['AAA'])
+        self.service.ttl = -1
+        self.service.get(['AAA'])
+        self.assertEqual(self.requests, [['AAA'], ['AAA']])
+
+    def test_symbols_without_quote_are_remembered(self):
+        self.assertEqual(list(self.service.get(['AAA', 'GONE'])), ['AAA'])
+        self.assertEqual(self.service.get(['AAA', 'GONE']).keys(), {'AAA'})
+        self.assertEqual(len(self.requests), 1)
+        with self.assertRaises(KeyError):
+            self.service.quote('GONE')
+
+    def test_poll_pushes_changes(self):
+        pushed = []
+        key = self.service.subscribe(['AAA', 'BBB'], pushed.append)
+        self.service.ttl = -1
+        self.assertEqual(set(self.service.poll()[key]), {'AAA', 'BBB'})
+        self.assertEqual(self.service.poll()[key], {})
+        self.prices['BBB'] = 2.5
+        self.assertEqual({i: quote.price for i, quote in self.service.poll()[key].items()}, {'BBB': 2.5})
+        self.assertEqual(len(pushed), 2)  # Polls without changes don't call back
+
+        self.service.unsubscribe(key)
+        self.assertEqual(self.service.poll(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
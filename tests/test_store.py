@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from market.store import merge_columns, normalize_columns, read_series, write_series
+
+DAY = 86400
+START = 1577880000  # 2020-01-01 12:00 UTC
+
+
+def columns(days, close, splits=(), dividends=()):
+    """Normalized columns with one bar at noon UTC of every day in days"""
+    return normalize_columns({
+        'timestamp': [START + i * DAY for i in days], 'close': close, 'volume': [100] * len(days),
+        'div_date': [START + i * DAY for i, amount in dividends], 'div_amount': [amount for i, amount in dividends],
+        'split_date': [START + i * DAY for i in splits], 'split_numerator': [2] * len(splits),
+        'split_denominator': [1] * len(splits)})
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_sorts_and_keeps_last_bar_of_day(self):
+        normalized = normalize_columns({'timestamp': [START + DAY, START, START + DAY + 60],
+                                        'close': [2.0, 1.0, 3.0]})
+        self.assertEqual(normalized['timestamp'].tolist(), [START, START + DAY + 60])
+        self.assertEqual(normalized['close'].tolist(), [1.0, 3.0])
+
+    def test_fills_missing_prices(self):
+        normalized = normalize_columns({'timestamp': [START + i * DAY for i in range(4)],
+                                        'close': [np.nan, 1.0, np.nan, 2.0], 'volume': [np.nan, 1, 1, 1]})
+        self.assertEqual(normalized['close'].tolist(), [1.0, 1.0, 2.0])  # The leading bar without a close is dropped
+        self.assertEqual(normalized['volume'].tolist(), [1, 1, 1])
+
+        backfilled = normalize_columns({'timestamp': [START, START + DAY], 'close': [np.nan, 1.0]}, leading='backfill')
+        self.assertEqual(backfilled['close'].tolist(), [1.0, 1.0])
+
+    def test_events_deduplicated_by_day(self):
+        normalized = normalize_columns({'timestamp': [START], 'close': [1.0],
+                                        'div_date': [START + DAY, START, START + DAY + 60],
+                                        'div_amount': [0.1, 0.2, 0.3]})
+        self.assertEqual(normalized['div_date'].tolist(), [START, START + DAY + 60])
+        self.assertEqual(normalized['div_amount'].tolist(), [0.2, 0.3])
+
+
+class MergeTest(unittest.TestCase):
+
+    def test_update_replaces_overlapping_bars(self):
+        cached = columns(range(5), [1.0, 2.0, 3.0, 4.0, 5.0], dividends=[(3, 0.5)])
+        update = columns(range(3, 7), [40.0, 50.0, 60.0, 70.0], dividends=[(3, 0.6), (6, 0.7)])
+        merged = merge_columns(cached, update)
+        self.assertEqual(merged['timestamp'].tolist(), [START + i * DAY for i in range(7)])
+        self.assertEqual(merged['close'].tolist(), [1.0, 2.0, 3.0, 40.0, 50.0, 60.0, 70.0])
+        self.assertEqual(merged['div_amount'].tolist(), [0.6, 0.7])  # Revised dividend of the update wins
+
+    def test_bar_revised_the_same_day(self):
+        cached = columns(range(3), [1.0, 2.0, 3.0])
+        update = normalize_columns({'timestamp': [START + 2 * DAY + 3600], 'close': [3.5]})
+        merged = merge_columns(cached, update)
+        self.assertEqual(merged['timestamp'].tolist(), [START, START + DAY, START + 2 * DAY + 3600])
+        self.assertEqual(merged['close'].tolist(), [1.0, 2.0, 3.5])
+
+    def test_empty_update_keeps_cache(self):
+        cached = columns(range(3), [1.0, 2.0, 3.0], splits=[1])
+        merged = merge_columns(cached, columns([], []))
+        self.assertEqual(merged['close'].tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(merged['split_date'].tolist(), [START + DAY])
+
+    def test_known_split_is_merged(self):
+        cached = columns(range(5), [1.0] * 5, splits=[2])
+        update = columns(range(2, 6), [1.0] * 4, splits=[2])
+        self.assertEqual(merge_columns(cached, update)['split_date'].tolist(), [START + 2 * DAY])
+
+    def test_unknown_split_returns_none(self):
+        cached = columns(range(5), [1.0] * 5, splits=[2])
+        update = columns(range(3, 6), [0.5] * 3, splits=[4])
+        self.assertIsNone(merge_columns(cached, update))
+
+
+class FileTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'series.bin')
+            written = columns(range(4), [1.0, 2.0, 3.0, 4.0], splits=[1], dividends=[(2, 0.5)])
+            write_series(file_path, written, {'currency': 'USD'})
+            header, read = read_series(file_path)
+            self.assertEqual(header['meta'], {'currency': 'USD'})
+            for name, values in written.items():
+                np.testing.assert_array_equal(np.asarray(read[name]), values, err_msg=name)
+            del read
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from market.transport import HttpClient, HttpError
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Stand-in server: keep-alive JSON answers, failing paths and redirects"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.client_address[1]))
+            count = sum(1 for path, port in server.requests if path == self.path)
+
+        if self.path == '/flaky' and count <= 2:
+            return self.answer(503)
+        if self.path == '/limited' and count == 1:
+            return self.answer(429, headers={'Retry-After': '0'})
+        if self.path == '/broken':
+            return self.answer(500)
+        if self.path == '/missing':
+            return self.answer(404)
+        if self.path.startswith('/redirect/'):
+            return self.answer(int(self.path.split('/')[2]), headers={'Location': '/data?from=redirect'})
+        if self.path == '/loop':
+            return self.answer(302, headers={'Location': '/loop'})
+        self.answer(200, {'path': self.path, 'method': 'GET'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests.append((self.path, self.client_address[1]))
+        if self.path == '/form':
+            return self.answer(303, headers={'Location': '/data'})
+        if self.path == '/moved':
+            return self.answer(307, headers={'Location': '/echo'})
+        self.answer(200, {'path': self.path, 'method': 'POST'})
+
+    def answer(self, status, payload=None, headers=None):
+        body = json.dumps(payload or {}).encode('utf8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.client = HttpClient(timeout=5, retries=3, backoff=0, rate=1000, burst=1000)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def paths(self):
+        return [path for path, port in self.server.requests]
+
+    def test_keep_alive_reuses_connection(self):
+        for i in range(5):
+            self.assertEqual(self.client.get_json(self.url + '/data?i={}'.format(i))['path'], '/data?i={}'.format(i))
+        self.assertEqual(len({port for path, port in self.server.requests}), 1)
+        self.assertEqual(self.client.stats()[self.url[7:]]['requests'], 5)
+
+    def test_retries_server_errors(self):
+        self.assertEqual(self.client.get_json(self.url + '/flaky')['path'], '/flaky')
+        self.assertEqual(self.paths(), ['/flaky'] * 3)
+
+    def test_retries_rate_limit(self):
+        self.assertEqual(self.client.get_json(self.url + '/limited')['path'], '/limited')
+        self.assertEqual(self.paths(), ['/limited'] * 2)
+
+    def test_gives_up_after_retries(self):
+        with self.assertRaises(HttpError) as error:
+            self.client.get(self.url + '/broken')
+        self.assertEqual(error.exception.status, 500)
+        self.assertEqual(len(self.paths()), self.client.retries + 1)
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(HttpError):
+            self.client.get(self.url + '/missing')
+        self.assertEqual(self.paths(), ['/missing'])
+
+    def test_follows_redirects(self):
+        for status in (301, 302, 303, 307, 308):
+            self.assertEqual(self.client.get_json(self.url + '/redirect/{}'.format(status))['path'],
+                             '/data?from=redirect')
+
+    def test_redirected_post(self):
+        self.assertEqual(self.client.post_json(self.url + '/form', {'a': 1}), {'path': '/data', 'method': 'GET'})
+        self.assertEqual(self.client.post_json(self.url + '/moved', {'a': 1}), {'path': '/echo', 'method': 'POST'})
+
+    def test_redirect_limit(self):
+        with self.assertRaises(HttpError):
+            self.client.get(self.url + '/loop')
+        self.assertEqual(len(self.paths()), self.client.max_redirects + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,18 @@ import datetime
 import json
 import traceback
 from functools import lru_cache
-from os import path
-from urllib.request import urlopen
+from os import path, remove
+from urllib.parse import urlparse
 
-import pandas as pd
+import numpy as np
+
+from market import quotes, transport
+from market.cpi import BLS_URL, IBGE_URL, CpiStore, fetch_bls, fetch_ibge
+from market.locks import FileLock
+from market.manifest import Manifest
+from market.series import PriceSeries
+from market.store import SCHEMA, chart_to_columns, file_checksum, merge_columns, migrate, normalize_columns, \
+    read_header, read_series, upgrade, write_series
 
 
 def get_date_range(start, end):
@@ -35,143 +43,258 @@ def get_date_range(start, end):
     return dates
 
 
+def to_timestamps(dates):
+    """Convert a datetime, a list of datetimes or an array of timestamps to a float64 array of timestamps"""
+    if isinstance(dates, np.ndarray) and dates.dtype.kind in 'fi':
+        return dates.astype(np.float64)
+    if isinstance(dates, datetime.datetime):
+        dates = [dates]
+    return np.array([i.timestamp() for i in dates], dtype=np.float64)
+
+
+CHART_URL = "https://query2.finance.yahoo.com/v8/finance/chart/{}?{}&region=US&interval=1d&lang=en&events=div%2Csplit"
+CHART_HOST = urlparse(CHART_URL).netloc
+UPDATE_OVERLAP = 5 * 24 * 3600  # Cached bars inside this window before the last one are downloaded again for revisions
+REFRESH_INTERVAL = 6 * 3600  # Series fetched less than this ago are not checked again for new data
+
+
 @lru_cache(maxsize=None)
-def get_ticker_history(ticker):
-    if path.exists('cache/' + ticker + '.json'):
+def get_manifest():
+    """Manifest of the cache directory, read once per process"""
+    return Manifest('cache')
 
-        try:
-            a = json.load(open('cache/' + ticker + '.json', "r"))
-
-            if datetime.datetime.fromtimestamp(a['chart']['result'][0]['timestamp'][-1]).date() < (
-                    datetime.datetime.today() - datetime.timedelta(
-                days=1)).date() and datetime.datetime.today().weekday() < 5:
-                #	print('Get {}, cache date {} last date {}'.format(ticker,datetime.datetime.fromtimestamp(a['chart']['result'][0]['timestamp'][-1]).date(),(datetime.datetime.today()-datetime.timedelta(days=1)).date()))
-                print('Downloading {} updated data, cache {}'.format(ticker, datetime.datetime.fromtimestamp(
-                    a['chart']['result'][0]['timestamp'][-1]).date()))
-                a = get_url(
-                    "https://query2.finance.yahoo.com/v8/finance/chart/{}?range=50y&region=US&interval=1d&lang=en&events=div%2Csplit".format(
-                        ticker))
-                with open('cache/' + ticker + '.json', 'w') as outfile:
-                    json.dump(a, outfile)
-        except Exception as e:
-            traceback.print_exc()
-            print('Downloading {} data'.format(ticker))
-            a = get_url(
-                "https://query2.finance.yahoo.com/v8/finance/chart/{}?range=50y&region=US&interval=1d&lang=en&events=div%2Csplit".format(
-                    ticker))
-            with open('cache/' + ticker + '.json', 'w') as outfile:
-                json.dump(a, outfile)
 
-    else:
-        print('Downloading {} data'.format(ticker))
-        a = get_url(
-            "https://query2.finance.yahoo.com/v8/finance/chart/{}?range=50y&region=US&interval=1d&lang=en&events=div%2Csplit".format(
-                ticker))
-        with open('cache/' + ticker + '.json', 'w') as outfile:
-            json.dump(a, outfile)
+def chart_is_stale(last):
+    """True if a daily series whose last bar is at timestamp last misses a weekday close"""
+    return last is None or datetime.datetime.fromtimestamp(last).date() < (
+            datetime.datetime.today() - datetime.timedelta(days=1)).date() and datetime.datetime.today().weekday() < 5
 
 
-    dat= pd.DataFrame(a)
+def recently_fetched(entry):
+    """True if the manifest entry was fetched less than REFRESH_INTERVAL ago"""
+    return datetime.datetime.now().timestamp() - entry.get('fetched', 0) < REFRESH_INTERVAL
 
 
-    return dat
+def save_series(name, file_path, symbol, columns, meta):
+    """
+    Write a chart series downloaded as symbol and record it in the manifest
 
+    Returns None, or the normalized columns and meta when the file can't be replaced (on Windows another process
+    having it memory mapped prevents it). The cache then keeps its previous version until a later run writes it
+    """
+    try:
+        header, checksum = write_series(file_path, columns, meta)
+    except PermissionError as e:
+        print('{} is in use, not updated ({})'.format(file_path, e))
+        return normalize_columns(columns, meta.get('gmtoffset', 0)), meta
+    get_manifest().update(name, header['last'], CHART_HOST, checksum, header['schema'], symbol=symbol)
 
-@lru_cache(maxsize=None)
-def get_cpi(loc='BR'):
-    if loc == 'BR':
-        dates = '199407%7C199408%7C199409%7C199410%7C199411%7C199412'
 
-        for y in range(1995, int(datetime.datetime.today().strftime('%Y')) + 1):
-            for m in range(1, 13):
-                dates += '%7C{}{:02d}'.format(y, m)
+def series_lock(name):
+    """Lock held while a cache series is downloaded or rewritten, shared with other processes using the cache"""
+    return FileLock('cache/' + name + '.lock')
 
-        url = 'https://servicodados.ibge.gov.br/api/v3/agregados/1737/periodos/{}/variaveis/2266?localidades=N1[all]'.format(
-            dates)
 
-    if loc == 'US':
-        pass
-    file_path = 'cache/{}_cpi.json'.format(loc)
-    if path.exists(file_path):
+def needs_refresh(entry):
+    """True if a chart series with this manifest entry (None if unknown) has to be written before being used"""
+    return entry is None or entry['schema'] != SCHEMA or chart_is_stale(entry['last']) and not recently_fetched(entry)
 
-        try:
-            a = json.load(open(file_path, "r"))
 
-            if list(a[0]['resultados'][0]['series'][0]['serie'].keys())[-1] != (
-                    datetime.datetime.today() - datetime.timedelta(days=20)).strftime("%Y%m"):
-                a = get_url(url)
-                with open(file_path, 'w+') as outfile:
-                    json.dump(a, outfile)
+def cached_history(name, symbol):
+    """
+    Columns and meta data of a chart series stored in cache/<name>.bin, symbol is the Yahoo Finance chart symbol
+
+    Freshness is decided from the cache manifest, the payload is only opened once it is known to be up to date.
+    Otherwise the series is refreshed under its lock file: a process that waited for another one to fetch the same
+    series reads the manifest again and reuses the result instead of downloading it a second time. Downloaded columns
+    that couldn't be written (see save_series) are returned as they are
+    """
+    file_path = 'cache/' + name + '.bin'
+    manifest = get_manifest()
+    if needs_refresh(manifest.get(name)) or not path.exists(file_path):
+        with series_lock(name):
+            manifest.reload()
+            unsaved = refresh_history(name, file_path, symbol)
+        if unsaved is not None:
+            return unsaved
+
+    header, columns = read_series(file_path)
+    return columns, header['meta']
+
+
+def refresh_history(name, file_path, symbol):
+    """
+    Bring cache/<name>.bin up to date, callers hold the series lock
+
+    Missing series are downloaded in full, stale ones only from their last cached bar on (see update_history).
+    JSON files left by older versions are converted on first use. Returns what save_series returned
+    """
+    manifest = get_manifest()
+    json_path = 'cache/' + name + '.json'
+    if not path.exists(file_path) and path.exists(json_path):
+        try:
+            fetched = path.getmtime(json_path)  # The JSON file is removed by migrate
+            header, checksum = migrate(json_path, file_path)
+            manifest.update(name, header['last'], CHART_HOST, checksum, header['schema'], fetched, symbol)
         except Exception as e:
+            traceback.print_exc()
+
+    if path.exists(file_path):
 
-            a = get_url(url)
-            with open(file_path, 'w+') as outfile:
-                json.dump(a, outfile)
+        try:
+            entry = manifest.get(name)
+            if entry is None or entry['schema'] != SCHEMA:  # Written before the manifest existed or by an older version
+                header = read_header(file_path)
+                fetched = entry['fetched'] if entry is not None else path.getmtime(file_path)
+                if header['schema'] < SCHEMA:
+                    header, checksum = upgrade(file_path)
+                elif header['schema'] == SCHEMA:
+                    checksum = file_checksum(file_path)
+                else:
+                    raise ValueError('{} has schema {}, expected {}'.format(file_path, header['schema'], SCHEMA))
+                manifest.update(name, header['last'], CHART_HOST, checksum, header['schema'], fetched, symbol)
+                entry = manifest.get(name)
+
+            if needs_refresh(entry):
+                print('Updating {} data, cache {}'.format(name, datetime.datetime.fromtimestamp(entry['last']).date()))
+                return update_history(name, file_path, symbol)
+        except transport.FixtureMissing as e:  # Offline without a recorded update, the stale cache is still usable
+            print('{}, using cached {} data'.format(e, name))
+        except Exception as e:
+            traceback.print_exc()
+            print('Downloading {} data'.format(name))
+            return save_series(name, file_path, symbol,
+                               *chart_to_columns(get_url(CHART_URL.format(symbol, 'range=50y'))))
 
     else:
-        a = get_url(url)
-        with open(file_path, 'w+') as outfile:
-            json.dump(a, outfile)
+        print('Downloading {} data'.format(name))
+        return save_series(name, file_path, symbol, *chart_to_columns(get_url(CHART_URL.format(symbol, 'range=50y'))))
 
-    x = []
-    y = []
-    for k, v in a[0]['resultados'][0]['series'][0]['serie'].items():
-        x.append(datetime.datetime.strptime(k, '%Y%m').timestamp())
-        y.append(float(v))
 
-    return x, y
+def update_history(name, file_path, symbol):
+    """
+    Download the bars since the last cached one and merge them into file_path
 
+    Falls back to a full download when the update has a split the cache does not know about, since the cached prices
+    are split adjusted. Returns what save_series returned
+    """
+    header, columns = read_series(file_path)
+    period = 'period1={}&period2={}'.format(header['last'] - UPDATE_OVERLAP, int(datetime.datetime.now().timestamp()))
+    update, meta = chart_to_columns(get_url(CHART_URL.format(symbol, period)))
 
-def get_url(url):
-    response = urlopen(url)
+    merged = merge_columns(columns, update, meta.get('gmtoffset', header['meta'].get('gmtoffset', 0)))
+    del columns  # Release the memory map before rewriting the file
 
-    a = json.loads(response.read().decode('utf8'))
-    return a
+    if merged is None:
+        print('New split for {}, downloading full history'.format(symbol))
+        return save_series(name, file_path, symbol, *chart_to_columns(get_url(CHART_URL.format(symbol, 'range=50y'))))
+    return save_series(name, file_path, symbol, merged, dict(header['meta'], **meta))
 
 
-def get_stock_price_live(ticker):
-    a = get_url("https://query2.finance.yahoo.com/v7/finance/quote?region=US&lang=en&symbols={}".format(ticker))
+@lru_cache(maxsize=None)
+def get_ticker_history(ticker):
+    """PriceSeries of a Yahoo Finance symbol, shared by every caller"""
+    columns, meta = cached_history(ticker, ticker)
 
-    return a['quoteResponse']['result'][0]['regularMarketPrice'], datetime.datetime.fromtimestamp(
-        a['quoteResponse']['result'][0]['regularMarketTime'])
+    return PriceSeries.from_columns(ticker, columns, meta)
+
+
+CPI_SOURCES = {'BR': 'IBGE', 'US': 'BLS'}
 
 
 @lru_cache(maxsize=None)
-def get_cur_exchange(pair):
-    if path.exists('cache/' + pair + '.json'):
+def get_cpi_store():
+    """CPI store of the cache directory, read once per process"""
+    return CpiStore('cache')
 
+
+def fetch_cpi(source):
+    """fetch(first, last) function for CpiStore.update"""
+    if source == 'IBGE':
+        return lambda first, last: fetch_ibge(first, last, get_url)
+    return lambda first, last: fetch_bls(first, last, transport.client.post_json)
+
+
+@lru_cache(maxsize=None)
+def get_cpi(loc='BR'):
+    """
+    CpiSeries of a location
+
+    Only the months missing from the local store are downloaded, at most once every REFRESH_INTERVAL. The JSON file
+    written by older versions is imported on first use
+    """
+    source = CPI_SOURCES[loc]
+    name = 'cpi_' + source
+    store = get_cpi_store()
+    manifest = get_manifest()
+    expected = (datetime.datetime.today() - datetime.timedelta(days=20)).strftime("%Y%m")
+
+    if cpi_needs_refresh(source, expected):
+        with series_lock(name):  # Same single flight as cached_history
+            manifest.reload()
+            store.reload()
+            refresh_cpi(loc, expected)
+
+    return store.series(source)
+
+
+def cpi_needs_refresh(source, expected):
+    """True if the store misses the expected month ('YYYYMM') of source and it wasn't checked recently"""
+    last = get_cpi_store().last(source)
+    return last is None or last < expected and not recently_fetched(get_manifest().get('cpi_' + source) or {})
+
+
+def refresh_cpi(loc, expected):
+    """Import the legacy CPI file or download the missing months, callers hold the series lock"""
+    source = CPI_SOURCES[loc]
+    name = 'cpi_' + source
+    host = urlparse(IBGE_URL if source == 'IBGE' else BLS_URL).netloc
+    store = get_cpi_store()
+    manifest = get_manifest()
+
+    legacy = 'cache/{}_cpi.json'.format(loc)
+    if store.last(source) is None and path.exists(legacy):
         try:
-            a = json.load(open('cache/' + pair + '.json', "r"))
-
-            if datetime.datetime.fromtimestamp(a['chart']['result'][0]['timestamp'][-1]).date() < (
-                    datetime.datetime.today() - datetime.timedelta(
-                days=1)).date() and datetime.datetime.today().weekday() < 5:
-                #	print('Get {}, cache date {} last date {}'.format(ticker,datetime.datetime.fromtimestamp(a['chart']['result'][0]['timestamp'][-1]).date(),(datetime.datetime.today()-datetime.timedelta(days=1)).date()))
-                print('Downloading {} updated data, cache {}'.format(pair, datetime.datetime.fromtimestamp(
-                    a['chart']['result'][0]['timestamp'][-1]).date()))
-                a = get_url(
-                    "https://query2.finance.yahoo.com/v8/finance/chart/{}=X?range=50y&region=US&interval=1d&lang=en&events=div%2Csplit".format(
-                        pair))
-                with open('cache/' + pair + '.json', 'w') as outfile:
-                    json.dump(a, outfile)
+            store.add(source, {k: float(v) for k, v in
+                               json.load(open(legacy, 'r'))[0]['resultados'][0]['series'][0]['serie'].items()})
+            manifest.update(name, store.last(source), host, file_checksum(store.path), 1, path.getmtime(legacy))
+            manifest.remove('{}_cpi'.format(loc))
+            remove(legacy)
         except Exception as e:
             traceback.print_exc()
-            print('Downloading {} data'.format(pair))
-            a = get_url(
-                "https://query2.finance.yahoo.com/v8/finance/chart/{}=X?range=50y&region=US&interval=1d&lang=en&events=div%2Csplit".format(
-                    pair))
-            with open('cache/' + pair + '.json', 'w') as outfile:
-                json.dump(a, outfile)
 
-    else:
-        print('Downloading {} data'.format(pair))
-        a = get_url(
-            "https://query2.finance.yahoo.com/v8/finance/chart/{}=X?range=50y&region=US&interval=1d&lang=en&events=div%2Csplit".format(
-                pair))
-        with open('cache/' + pair + '.json', 'w') as outfile:
-            json.dump(a, outfile)
+    if cpi_needs_refresh(source, expected):
+        print('Updating {} CPI data'.format(source))
+        try:
+            store.update(source, fetch_cpi(source))
+        except transport.FixtureMissing as e:
+            if store.last(source) is None:
+                raise
+            print('{}, using cached {} CPI data'.format(e, source))
+            return
+        manifest.update(name, store.last(source), host, file_checksum(store.path), 1)
+
+
+def get_url(url):
+
+    return transport.client.get_json(url)
+
+
+def get_stock_price_live(ticker):
+    """Price and time of the last trade, served by the batched quote service (see Portfolio.refresh_quotes)"""
+    quote = quotes.service.quote(ticker)
+
+    return quote.price, quote.time
 
-    return a['chart']['result'][0]['timestamp'], a['chart']['result'][0]['indicators']['quote'][0]['close']
 
+def cached_pairs():
+    """Currency pairs (ex. USDBRL) cached as chart series, recognized by their Yahoo symbol (USDBRL=X) in the manifest"""
+    return sorted(name for name, entry in get_manifest().entries().items() if entry.get('symbol', '').endswith('=X'))
 
 
+@lru_cache(maxsize=None)
+def get_cur_exchange(pair):
+    """PriceSeries of a currency pair (ex. USDBRL)"""
+    columns, meta = cached_history(pair, pair + '=X')
+
+    return PriceSeries.from_columns(pair, columns, meta)